@@ -1,63 +1,153 @@
 import cv2
 import numpy as np
-from typing import Dict, Tuple
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
 
-# Load Haar Cascade for face detection
+from app.decision_cache import DecisionCache, dhash
+from app.timing import timed
+
+FACE_CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+
+def _load_cascade(xml: str) -> cv2.CascadeClassifier:
+    """Build a face cascade from its XML text"""
+    cascade = cv2.CascadeClassifier()
+    storage = cv2.FileStorage(xml, cv2.FILE_STORAGE_READ | cv2.FILE_STORAGE_MEMORY)
+    if not cascade.read(storage.getFirstTopLevelNode()):
+        raise ValueError("Invalid face cascade XML")
+    return cascade
+
+# Load Haar Cascade for face detection; the XML stays in memory (and is
+# shared copy-on-write by forked workers) so threads never re-read the file
 try:
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-except:
+    with open(FACE_CASCADE_PATH) as f:
+        FACE_CASCADE_XML = f.read()
+    face_cascade = _load_cascade(FACE_CASCADE_XML)
+except Exception:
+    FACE_CASCADE_XML = None
     face_cascade = None
     print("Warning: Face detection model not loaded")
 
-def analyze_image(image_path: str) -> Dict:
+# CascadeClassifier.detectMultiScale is not thread-safe, so every worker
+# thread detects with its own copy of the cascade
+_thread_cascades = threading.local()
+
+def get_face_cascade() -> Optional[cv2.CascadeClassifier]:
     """
-    Analyze image to extract features for protection decision
+    The calling thread's face cascade (None if the model could not be loaded)
+    The main thread reuses face_cascade; other threads build their own from
+    FACE_CASCADE_XML on first use (warm_worker does this before serving)
     """
-    img = cv2.imread(image_path)
+    if face_cascade is None:
+        return None
+    cascade = getattr(_thread_cascades, "cascade", None)
+    if cascade is None:
+        if threading.current_thread() is threading.main_thread():
+            cascade = face_cascade
+        else:
+            cascade = _load_cascade(FACE_CASCADE_XML)
+        _thread_cascades.cascade = cascade
+    return cascade
+
+# Face detection and brightness run on a copy downscaled to this longest side (0 = full size)
+FACE_DETECT_MAX_SIDE = int(os.getenv("FACE_DETECT_MAX_SIDE", "640"))
+
+# Face counts are memoized on a perceptual hash; hashes within this many bits match
+decision_cache = DecisionCache(
+    int(os.getenv("DECISION_CACHE_SIZE", "4096")),
+    int(os.getenv("DECISION_CACHE_MAX_DISTANCE", "4"))
+)
+
+# Smallest face the Haar cascade can find (its training window)
+MIN_FACE_SIZE = 24
+
+# Faces at least this large are first looked for in cheap halving size bands
+# so prominent faces exit early; anything smaller is left to one full pass
+EARLY_EXIT_MIN_FACE = 4 * MIN_FACE_SIZE
+
+def downscale_image(img: np.ndarray, max_side: int) -> np.ndarray:
+    """
+    Shrink image so its longest side is at most max_side (area interpolation)
+    """
+    h, w = img.shape[:2]
+    if max_side <= 0 or max(h, w) <= max_side:
+        return img
+    scale = max_side / max(h, w)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+@timed("faces")
+def detect_faces(gray: np.ndarray) -> int:
+    """
+    Count faces in a grayscale image
+    Large faces are the cheapest to scan, so bands from the largest possible
+    face down to EARLY_EXIT_MIN_FACE (halving each time) are tried first and
+    the first band with a hit is returned; its count only covers that band.
+    Otherwise one full pass runs, because a face whose raw detections straddle
+    a band boundary can fall below minNeighbors in both bands.
+    A band only sees a subset of the full pass's detections, so this finds a
+    face exactly when a single full pass would.
+    """
+    cascade = get_face_cascade()
+    if cascade is None:
+        return 0
     
+    max_size = min(gray.shape[:2])
+    while max_size // 2 >= EARLY_EXIT_MIN_FACE:
+        faces = cascade.detectMultiScale(
+            gray, 1.1, 4,
+            minSize=(max_size // 2, max_size // 2),
+            maxSize=(max_size, max_size)
+        )
+        if len(faces) > 0:
+            return len(faces)
+        max_size //= 2
+    
+    faces = cascade.detectMultiScale(gray, 1.1, 4, minSize=(MIN_FACE_SIZE, MIN_FACE_SIZE))
+    return len(faces)
+
+def analyze_image(img: np.ndarray, max_side: int = FACE_DETECT_MAX_SIDE) -> Dict:
+    """
+    Analyze image to extract features for protection decision
+    Detection and brightness use a copy downscaled to max_side
+    """
     if img is None:
         return {"faces": 0, "brightness": 0, "size": 0}
     
+    # Image size
+    h, w = img.shape[:2]
+    size = h * w
+    
     # Detect faces
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    faces = []
-    if face_cascade is not None:
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+    small = downscale_image(img, max_side)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    faces = detect_faces(gray)
     
     # Calculate brightness
     brightness = np.mean(gray)
     
-    # Image size
-    h, w, _ = img.shape
-    size = h * w
-    
     return {
-        "faces": len(faces),
+        "faces": faces,
         "brightness": brightness,
         "size": size,
         "dimensions": (h, w)
     }
 
-def assess_risk_level(features: Dict) -> str:
-    """
-    Assess risk based on image features
-    Face detection -> likely personal/sensitive
-    High resolution -> likely for public use
-    """
-    risk_score = 0
-    
-    # Face detection (strong indicator)
-    if features["faces"] > 0:
-        risk_score += 40
-    
+RISK_LEVELS = {"LOW": 0, "MEDIUM": 1, "HIGH": 2}
+
+# Content signals in evaluation order (cheapest first): (feature, weight, triggered)
+RISK_SIGNALS = [
     # High resolution images are more likely to be misused
-    if features["size"] > 1000000:  # > 1MP
-        risk_score += 20
-    
+    ("size", 20, lambda value: value > 1000000),
     # Well-lit images (higher quality)
-    if features["brightness"] > 120:
-        risk_score += 10
-    
+    ("brightness", 10, lambda value: value > 120),
+    # Face detection (strong indicator)
+    ("faces", 40, lambda value: value > 0),
+]
+
+def risk_level_for_score(risk_score: int) -> str:
+    """Map a content risk score to a protection level"""
     if risk_score >= 50:
         return "HIGH"
     elif risk_score >= 25:
@@ -65,36 +155,105 @@ def assess_risk_level(features: Dict) -> str:
     else:
         return "LOW"
 
-def decide_protection_level(image_path: str, filename: str = "") -> Tuple[str, Dict]:
+def assess_risk_level(features: Dict) -> str:
     """
-    Agentic decision logic combining filename hints and image analysis
-    Returns: (protection_level, analysis_metadata)
+    Assess risk based on image features (as returned by analyze_image)
+    Face detection -> likely personal/sensitive
+    High resolution -> likely for public use
+    """
+    risk_score = sum(weight for name, weight, triggered in RISK_SIGNALS if triggered(features[name]))
+    return risk_level_for_score(risk_score)
+
+def filename_risk_level(filename: str) -> str:
+    """
+    Filename-based hints
     """
-    # Analyze image content
-    features = analyze_image(image_path)
-    
-    # Filename-based hints
     filename_lower = filename.lower()
-    filename_risk = "LOW"
     
     if any(keyword in filename_lower for keyword in ["profile", "headshot", "portrait"]):
-        filename_risk = "HIGH"
+        return "HIGH"
     elif any(keyword in filename_lower for keyword in ["selfie", "avatar", "photo"]):
-        filename_risk = "MEDIUM"
+        return "MEDIUM"
+    return "LOW"
+
+@timed("decide")
+def decide_protection_level(image: np.ndarray, filename: str = "", image_info: Optional[Dict] = None) -> Tuple[str, Dict]:
+    """
+    Agentic decision logic combining filename hints and image analysis
+    Takes the decoded BGR image so the upload is only decoded once per request
+    Signals are evaluated lazily, cheapest first; a signal is skipped once no
+    remaining content evidence could raise the level above what is already known
+    image_info (from app.probe) supplies resolution without touching pixels
+    Returns: (protection_level, analysis_metadata)
+    """
+    # Filename-based hints
+    filename_risk = filename_risk_level(filename)
+    evaluated = ["filename"]
+    skipped = []
+    
+    # Brightness and faces share one downscaled grayscale copy, built on first use
+    @lru_cache(maxsize=1)
+    def small_gray() -> np.ndarray:
+        return cv2.cvtColor(downscale_image(image, FACE_DETECT_MAX_SIDE), cv2.COLOR_BGR2GRAY)
+    
+    # Face detection is the expensive signal, so it is memoized on a perceptual
+    # hash; resolution and brightness are cheap and always measured fresh, so
+    # the level stays exact for resized or re-exposed variants
+    cache_status = None
+    
+    def faces() -> int:
+        nonlocal cache_status
+        phash = dhash(small_gray())
+        count = decision_cache.lookup(phash, "faces")
+        if count is not None:
+            cache_status = "HIT"
+            return count
+        cache_status = "MISS"
+        count = detect_faces(small_gray())
+        decision_cache.store(phash, "faces", count)
+        return count
+    
+    extractors = {
+        "size": lambda: (
+            image_info["width"] * image_info["height"] if image_info
+            else image.shape[0] * image.shape[1]
+        ),
+        "brightness": lambda: float(np.mean(small_gray())),
+        "faces": faces,
+    }
     
     # Image content-based risk
-    content_risk = assess_risk_level(features)
+    features = {}
+    risk_score = 0
+    remaining = sum(weight for _, weight, _ in RISK_SIGNALS)
+    for name, weight, triggered in RISK_SIGNALS:
+        # Final decision is the higher of the two, so stop once content can't raise it
+        floor = max(RISK_LEVELS[filename_risk], RISK_LEVELS[risk_level_for_score(risk_score)])
+        if RISK_LEVELS[risk_level_for_score(risk_score + remaining)] <= floor:
+            skipped.append(name)
+            continue
+        
+        features[name] = extractors[name]()
+        evaluated.append(name)
+        if triggered(features[name]):
+            risk_score += weight
+        remaining -= weight
+    
+    # Content risk from the evaluated signals only
+    content_risk = risk_level_for_score(risk_score)
     
     # Final decision: take the higher of the two
-    risk_levels = {"LOW": 0, "MEDIUM": 1, "HIGH": 2}
-    final_level = max(filename_risk, content_risk, key=lambda x: risk_levels[x])
+    final_level = max(filename_risk, content_risk, key=lambda x: RISK_LEVELS[x])
     
     metadata = {
         "filename_risk": filename_risk,
         "content_risk": content_risk,
-        "faces_detected": features["faces"],
-        "image_size": features["size"],
-        "final_protection": final_level
+        "faces_detected": features.get("faces"),
+        "image_size": features.get("size"),
+        "final_protection": final_level,
+        "signals_evaluated": evaluated,
+        "signals_skipped": skipped,
+        "decision_cache": cache_status
     }
     
     return final_level, metadata
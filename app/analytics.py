@@ -0,0 +1,291 @@
+import bisect
+import json
+import os
+import sqlite3
+import threading
+from collections import deque
+from itertools import islice
+from typing import Dict, List, Optional
+
+# Geometric latency buckets (upper bounds in ms, 1ms .. ~2min, 25% apart),
+# so percentile estimates are within one bucket (~12%) of the true value
+LATENCY_BUCKETS_MS = [round(1.25 ** i, 2) for i in range(53)]
+
+PROTECTION_LEVELS = ("HIGH", "MEDIUM", "LOW")
+
+def latency_bucket(latency_ms: float) -> int:
+    """Histogram bucket index for a latency (last bucket is overflow)"""
+    return bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+
+def histogram_percentile(counts: List[int], q: float) -> Optional[float]:
+    """
+    Estimate the q-th percentile (0-100) from bucket counts
+    Interpolates linearly inside the bucket holding the target rank
+    """
+    total = sum(counts)
+    if total == 0:
+        return None
+    
+    rank = q / 100 * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if count and seen + count >= rank:
+            lower = LATENCY_BUCKETS_MS[i - 1] if i > 0 else 0.0
+            upper = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else LATENCY_BUCKETS_MS[-1]
+            return round(lower + (upper - lower) * (rank - seen) / count, 2)
+        seen += count
+    return LATENCY_BUCKETS_MS[-1]
+
+def empty_histogram() -> List[int]:
+    return [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+def recordable_stages(entry: Dict) -> Dict[str, float]:
+    """
+    Stage timings of an analytics entry that reflect work done for it
+    Cache hits carry the timings of the original run, so they are left out
+    """
+    if entry.get("cache_hit"):
+        return {}
+    return entry.get("stage_timings_ms") or {}
+
+def build_summary(snapshot: Dict, recent: List[Dict]) -> Dict:
+    """Shape an aggregator snapshot into the /analytics response"""
+    total = snapshot["total"]
+    if total == 0:
+        return {"total_processed": 0, "recent": []}
+    
+    levels = snapshot["levels"]
+    histogram = snapshot["histogram"]
+    return {
+        "total_processed": total,
+        "recent": recent,
+        "avg_processing_time_ms": round(snapshot["latency_sum"] / total, 2),
+        "protection_levels": {level: levels.get(level, (0, 0.0))[0] for level in PROTECTION_LEVELS},
+        "avg_processing_time_by_level_ms": {
+            level: round(levels[level][1] / levels[level][0], 2)
+            for level in PROTECTION_LEVELS if levels.get(level, (0, 0.0))[0]
+        },
+        "latency_percentiles_ms": {
+            "p50": histogram_percentile(histogram, 50),
+            "p95": histogram_percentile(histogram, 95),
+            "p99": histogram_percentile(histogram, 99)
+        },
+        "stages": {
+            name: {
+                "count": count,
+                "avg_ms": round(stage_sum / count, 2),
+                "p95_ms": histogram_percentile(stage_histogram, 95)
+            }
+            for name, (count, stage_sum, stage_histogram) in snapshot["stages"].items() if count
+        }
+    }
+
+def _prometheus_histogram(lines: List[str], name: str, labels: str, histogram: List[int], total_ms: float):
+    bucket_labels = f"{labels}," if labels else ""
+    series_labels = f"{{{labels}}}" if labels else ""
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS_MS, histogram):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{bucket_labels}le="{bound / 1000:g}"}} {cumulative}')
+    cumulative += histogram[-1]
+    lines.append(f'{name}_bucket{{{bucket_labels}le="+Inf"}} {cumulative}')
+    lines.append(f"{name}_sum{series_labels} {total_ms / 1000:.6f}")
+    lines.append(f"{name}_count{series_labels} {cumulative}")
+
+def prometheus_text(snapshot: Dict, pool: Optional[Dict] = None) -> str:
+    """
+    Render an aggregator snapshot in the Prometheus text exposition format
+    pool (ProtectionPool.stats) adds this process's worker pool gauges
+    """
+    lines = [
+        "# HELP consentra_images_processed_total Images processed, by protection level",
+        "# TYPE consentra_images_processed_total counter",
+    ]
+    for level in PROTECTION_LEVELS:
+        count = snapshot["levels"].get(level, (0, 0.0))[0]
+        lines.append(f'consentra_images_processed_total{{level="{level}"}} {count}')
+    
+    lines += [
+        "# HELP consentra_processing_duration_seconds End-to-end processing time per image",
+        "# TYPE consentra_processing_duration_seconds histogram",
+    ]
+    _prometheus_histogram(
+        lines, "consentra_processing_duration_seconds", "", snapshot["histogram"], snapshot["latency_sum"]
+    )
+    
+    lines += [
+        "# HELP consentra_stage_duration_seconds Time spent in each pipeline stage",
+        "# TYPE consentra_stage_duration_seconds histogram",
+    ]
+    for name, (_, stage_sum, stage_histogram) in sorted(snapshot["stages"].items()):
+        _prometheus_histogram(
+            lines, "consentra_stage_duration_seconds", f'stage="{name}"', stage_histogram, stage_sum
+        )
+    
+    if pool is not None:
+        lines += [
+            "# HELP consentra_worker_pool_in_flight Protection tasks running or queued in this process's pool",
+            "# TYPE consentra_worker_pool_in_flight gauge",
+            f'consentra_worker_pool_in_flight{{mode="{pool["mode"]}"}} {pool["in_flight"]}',
+            "# HELP consentra_worker_pool_capacity Most protection tasks this process's pool accepts at once",
+            "# TYPE consentra_worker_pool_capacity gauge",
+            f'consentra_worker_pool_capacity{{mode="{pool["mode"]}"}} {pool["capacity"]}',
+        ]
+    return "\n".join(lines) + "\n"
+
+class MemoryAnalytics:
+    """
+    Per-process streaming aggregator
+    Every record is O(1): a bounded deque of recent entries, running totals
+    per protection level and a fixed-size latency histogram
+    """
+    
+    def __init__(self, recent_size: int = 1000):
+        self._recent = deque(maxlen=recent_size)
+        self._total = 0
+        self._latency_sum = 0.0
+        self._levels: Dict[str, List] = {}
+        self._histogram = empty_histogram()
+        self._stages: Dict[str, List] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, entry: Dict):
+        latency = entry.get("processing_time_ms", 0.0)
+        with self._lock:
+            self._recent.append(entry)
+            self._total += 1
+            self._latency_sum += latency
+            level = self._levels.setdefault(entry.get("protection_level"), [0, 0.0])
+            level[0] += 1
+            level[1] += latency
+            self._histogram[latency_bucket(latency)] += 1
+            for name, duration in recordable_stages(entry).items():
+                stage = self._stages.setdefault(name, [0, 0.0, empty_histogram()])
+                stage[0] += 1
+                stage[1] += duration
+                stage[2][latency_bucket(duration)] += 1
+    
+    def snapshot(self) -> Dict:
+        """Copy of all counters and histograms"""
+        with self._lock:
+            return {
+                "total": self._total,
+                "latency_sum": self._latency_sum,
+                "levels": {level: tuple(values) for level, values in self._levels.items()},
+                "histogram": list(self._histogram),
+                "stages": {name: (count, total, list(hist)) for name, (count, total, hist) in self._stages.items()}
+            }
+    
+    def summary(self, recent: int = 10) -> Dict:
+        with self._lock:
+            recent_entries = list(islice(reversed(self._recent), recent))[::-1]
+        return build_summary(self.snapshot(), recent_entries)
+
+class SqliteAnalytics:
+    """
+    Aggregator backed by a SQLite file shared by every worker process
+    Counters and histogram buckets are upserted in place and recent entries
+    live in a fixed ring of rows, so each record is a handful of O(1) writes
+    and all workers report the same totals
+    """
+    
+    def __init__(self, path: str, recent_size: int = 1000):
+        self.path = path
+        self.recent_size = recent_size
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS recent (slot INTEGER PRIMARY KEY, seq INTEGER, entry TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS recent_seq ON recent (seq)")
+    
+    def _add(self, key: str, amount: float):
+        self._conn.execute(
+            "INSERT INTO counters (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+            (key, amount)
+        )
+    
+    def record(self, entry: Dict):
+        latency = entry.get("processing_time_ms", 0.0)
+        level = entry.get("protection_level")
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so the sequence number
+            # and ring slot are consistent across processes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._add("total", 1)
+                self._add("latency_sum", latency)
+                self._add(f"level_count:{level}", 1)
+                self._add(f"level_latency:{level}", latency)
+                self._add(f"bucket:{latency_bucket(latency)}", 1)
+                for name, duration in recordable_stages(entry).items():
+                    self._add(f"stage_count:{name}", 1)
+                    self._add(f"stage_sum:{name}", duration)
+                    self._add(f"stage_bucket:{name}:{latency_bucket(duration)}", 1)
+                seq = int(self._conn.execute("SELECT value FROM counters WHERE key = 'total'").fetchone()[0])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO recent (slot, seq, entry) VALUES (?, ?, ?)",
+                    (seq % self.recent_size, seq, json.dumps(entry, default=str))
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def snapshot(self) -> Dict:
+        """All counters and histograms, as written by every process"""
+        with self._lock:
+            counters = self._conn.execute("SELECT key, value FROM counters").fetchall()
+        
+        snapshot = {"total": 0, "latency_sum": 0.0, "levels": {}, "histogram": empty_histogram(), "stages": {}}
+        level_latency = {}
+        for key, value in counters:
+            kind, _, name = key.partition(":")
+            if kind == "total":
+                snapshot["total"] = int(value)
+            elif kind == "latency_sum":
+                snapshot["latency_sum"] = value
+            elif kind == "bucket":
+                snapshot["histogram"][int(name)] = int(value)
+            elif kind == "level_count":
+                snapshot["levels"][name] = int(value)
+            elif kind == "level_latency":
+                level_latency[name] = value
+            elif kind == "stage_count":
+                snapshot["stages"].setdefault(name, [0, 0.0, empty_histogram()])[0] = int(value)
+            elif kind == "stage_sum":
+                snapshot["stages"].setdefault(name, [0, 0.0, empty_histogram()])[1] = value
+            elif kind == "stage_bucket":
+                stage, _, bucket = name.rpartition(":")
+                snapshot["stages"].setdefault(stage, [0, 0.0, empty_histogram()])[2][int(bucket)] = int(value)
+        
+        snapshot["levels"] = {
+            level: (count, level_latency.get(level, 0.0)) for level, count in snapshot["levels"].items()
+        }
+        snapshot["stages"] = {name: tuple(values) for name, values in snapshot["stages"].items()}
+        return snapshot
+    
+    def summary(self, recent: int = 10) -> Dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT entry FROM recent ORDER BY seq DESC LIMIT ?", (recent,)
+            ).fetchall()
+        return build_summary(self.snapshot(), [json.loads(entry) for (entry,) in reversed(rows)])
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def create_analytics(backend: str, recent_size: int, path: str):
+    """
+    Build the analytics aggregator for the configured backend ("memory" or "sqlite")
+    """
+    if backend == "memory":
+        return MemoryAnalytics(recent_size)
+    if backend == "sqlite":
+        return SqliteAnalytics(path, recent_size)
+    raise ValueError(f"Unknown analytics backend: {backend}")
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+def dhash(gray: np.ndarray) -> int:
+    """
+    64-bit difference hash of a grayscale image
+    Signs of horizontal gradients on a 9x8 thumbnail; stable under resizing and
+    recompression, so variants of one photo land within a few bits of each other
+    """
+    thumb = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = thumb[:, 1:] > thumb[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count("1")
+
+class DecisionCache:
+    """
+    Bounded LRU of agent content features keyed on perceptual hash
+    A lookup matches any stored hash within max_distance bits, so resized or
+    recompressed copies of an image reuse its expensive features (face count)
+    """
+    
+    def __init__(self, max_entries: int = 4096, max_distance: int = 4):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def _find(self, phash: int) -> Optional[int]:
+        if phash in self._entries:
+            return phash
+        if self.max_distance <= 0:
+            return None
+        
+        # Nearest stored hash within tolerance
+        best, best_distance = None, self.max_distance + 1
+        for stored in self._entries:
+            distance = hamming_distance(phash, stored)
+            if distance < best_distance:
+                best, best_distance = stored, distance
+        return best
+    
+    def lookup(self, phash: int, feature: str) -> Optional[object]:
+        """
+        Cached value of `feature` for an image near phash, or None
+        """
+        with self._lock:
+            key = self._find(phash)
+            if key is not None and feature in self._entries[key]:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][feature]
+            self.misses += 1
+            return None
+    
+    def store(self, phash: int, feature: str, value: object):
+        """Record a computed feature for phash"""
+        with self._lock:
+            self._entries.setdefault(phash, {})[feature] = value
+            self._entries.move_to_end(phash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict:
+        """Hit statistics and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_distance": self.max_distance,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
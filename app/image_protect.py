@@ -1,49 +1,87 @@
 import cv2
 import numpy as np
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
+from typing import Optional, Tuple
 
-def apply_adversarial_noise(image: np.ndarray, strength: float) -> np.ndarray:
+from app.shape_cache import shape_cache
+from app.timing import span, timed
+
+def _build_high_pass_mask(rows: int, cols: int, dtype: np.dtype) -> np.ndarray:
+    """
+    High-pass mask over the half spectrum returned by rfft2 for a rows x cols image
+    Same radius test as a centred ogrid mask (> min(rows, cols) // 4), laid out
+    in unshifted FFT order so no fftshift/ifftshift is needed
+    """
+    # Signed frequency of each unshifted bin, i.e. ifftshift of (index - center)
+    fy = np.fft.ifftshift(np.arange(rows) - rows // 2)
+    fx = np.fft.ifftshift(np.arange(cols) - cols // 2)[:cols // 2 + 1]
+    
+    return (np.sqrt(fy[:, np.newaxis] ** 2 + fx[np.newaxis, :] ** 2) > min(rows, cols) // 4).astype(dtype)
+
+def high_pass_mask(rows: int, cols: int) -> np.ndarray:
+    """Cached, read-only float32 high-pass mask for a rows x cols image"""
+    return shape_cache.get("high_pass_mask", rows, cols, np.float32, _build_high_pass_mask)
+
+def create_rng(seed: Optional[int] = None) -> np.random.Generator:
+    """
+    Create a PCG64 generator for one protection run
+    Without a seed it is seeded from OS entropy; each request gets its own
+    generator, so concurrent workers never share RNG state
+    """
+    return np.random.default_rng(seed)
+
+def _noise_spectrum(shape: Tuple[int, ...], strength: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Masked high-frequency noise over the rfft2 half spectrum of an image of `shape`
+    irfft2 mirrors the half spectrum into its Hermitian pair, so the noise is
+    scaled by 1/sqrt(2) to match the per-pixel variance of taking the real part
+    of a full complex ifft2
+    """
+    rows, cols, channels = shape
+    # Draw interleaved (real, imag) float32 pairs and view them as complex64
+    pairs = rng.standard_normal((rows, cols // 2 + 1, channels, 2), dtype=np.float32)
+    noise_fft = pairs.view(np.complex64)[..., 0]
+    noise_fft *= high_pass_mask(rows, cols)[:, :, np.newaxis]
+    noise_fft *= np.float32(strength * 10 / np.sqrt(2))
+    return noise_fft
+
+@timed("noise")
+def apply_adversarial_noise(image: np.ndarray, strength: float, rng: Optional[np.random.Generator] = None) -> np.ndarray:
     """
     Apply adversarial noise that's imperceptible to humans but confuses AI models
     Uses combination of spatial and frequency domain perturbations
     """
+    rng = rng if rng is not None else create_rng()
+    
     # Spatial domain noise
-    spatial_noise = np.random.randn(*image.shape) * strength
+    spatial_noise = rng.standard_normal(image.shape, dtype=np.float32)
+    spatial_noise *= strength
     
     # Frequency domain perturbations (targets AI feature extraction)
-    # Convert to frequency domain per channel
-    freq_noise = np.zeros_like(image, dtype=np.float32)
-    for c in range(image.shape[2]):
-        fft = np.fft.fft2(image[:, :, c])
-        # Add noise to high-frequency components (less visible, more disruptive)
-        fft_shifted = np.fft.fftshift(fft)
-        rows, cols = fft_shifted.shape
-        center_row, center_col = rows // 2, cols // 2
-        
-        # Create high-pass filter
-        y, x = np.ogrid[:rows, :cols]
-        mask = np.sqrt((x - center_col)**2 + (y - center_row)**2) > min(rows, cols) // 4
-        
-        # Add noise to high frequencies
-        noise_fft = np.random.randn(rows, cols) + 1j * np.random.randn(rows, cols)
-        fft_shifted = fft_shifted + mask * noise_fft * strength * 10
-        
-        # Transform back
-        fft = np.fft.ifftshift(fft_shifted)
-        freq_noise[:, :, c] = np.real(np.fft.ifft2(fft))
+    # All channels are handled by one real FFT over axes (0, 1). The FFT is
+    # linear, so ifft(fft(image) + noise) == image + ifft(noise) and only the
+    # noise spectrum needs transforming.
+    rows, cols = image.shape[:2]
+    noise_fft = _noise_spectrum(image.shape, strength, rng)
+    freq_noise = np.fft.irfft2(noise_fft, s=(rows, cols), axes=(0, 1)).astype(np.float32, copy=False)
+    freq_noise += image
     
-    return spatial_noise + freq_noise * 0.3
+    return spatial_noise + freq_noise * np.float32(0.3)
 
-def apply_gradient_based_protection(image: np.ndarray, iterations: int = 3) -> np.ndarray:
+@timed("gradient")
+def apply_gradient_based_protection(image: np.ndarray, iterations: int = 3, rng: Optional[np.random.Generator] = None) -> np.ndarray:
     """
     Apply gradient-based perturbations targeting deep learning models
     Simulates adversarial attack patterns
     """
+    rng = rng if rng is not None else create_rng()
     protected = image.copy()
     
     for _ in range(iterations):
         # Simulate gradient direction (random direction for now)
-        gradient = np.random.randn(*image.shape)
+        gradient = rng.standard_normal(image.shape, dtype=np.float32)
         gradient = gradient / (np.linalg.norm(gradient) + 1e-8)
         
         # Apply small perturbation in gradient direction
@@ -51,61 +89,284 @@ def apply_gradient_based_protection(image: np.ndarray, iterations: int = 3) -> n
     
     return protected
 
+def _build_robustness_texture(h: int, w: int, dtype: np.dtype) -> np.ndarray:
+    """
+    Sine texture added by enhance_robustness, pre-scaled by its 0.5 weight
+    """
+    texture = np.sin(np.linspace(0, 50, h))[:, np.newaxis] * np.sin(np.linspace(0, 50, w))[np.newaxis, :]
+    return (texture * 0.5).astype(dtype)
+
+@timed("texture")
 def enhance_robustness(image: np.ndarray) -> np.ndarray:
     """
     Apply additional processing to make protection robust to common transformations
     (compression, scaling, etc.)
     """
-    # Add slight texture that survives compression
+    # Add slight texture that survives compression; one (h, w) texture is
+    # cached per shape and broadcast across channels
     h, w = image.shape[:2]
-    texture = np.sin(np.linspace(0, 50, h))[:, np.newaxis] * np.sin(np.linspace(0, 50, w))[np.newaxis, :]
-    texture = np.stack([texture] * 3, axis=2)
+    texture = shape_cache.get("robustness_texture", h, w, image.dtype, _build_robustness_texture)
     
-    image = image + texture * 0.5
+    image = image + texture[:, :, np.newaxis]
     return image
 
-def protect_image(image_path: str, level: str) -> Tuple[np.ndarray, dict]:
+@timed("decode")
+def decode_image(data: bytes) -> Optional[np.ndarray]:
     """
-    Apply comprehensive image protection based on level
-    Returns: (protected_image, processing_metadata)
+    Decode uploaded image bytes into a BGR array
+    Returns None if the bytes are not a supported image
     """
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError(f"Could not read image from {image_path}")
-    
-    image = image.astype(np.float32)
-    
-    # Protection parameters by level
-    protection_params = {
-        "HIGH": {"noise_strength": 10, "gradient_iterations": 5, "enhance": True},
-        "MEDIUM": {"noise_strength": 6, "gradient_iterations": 3, "enhance": True},
-        "LOW": {"noise_strength": 3, "gradient_iterations": 1, "enhance": False}
-    }
-    
-    params = protection_params.get(level, protection_params["LOW"])
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+# Protection parameters by level
+PROTECTION_PARAMS = {
+    "HIGH": {"noise_strength": 10, "gradient_iterations": 5, "enhance": True},
+    "MEDIUM": {"noise_strength": 6, "gradient_iterations": 3, "enhance": True},
+    "LOW": {"noise_strength": 3, "gradient_iterations": 1, "enhance": False}
+}
+
+def _protect_in_place(work: np.ndarray, params: dict, rng: np.random.Generator):
+    """
+    Run every protection stage directly on a float32 working buffer
+    Same perturbations as apply_adversarial_noise, apply_gradient_based_protection
+    and enhance_robustness, but the only full-size temporaries are the noise
+    half spectrum and a single float32 scratch buffer
+    """
+    rows, cols = work.shape[:2]
+    strength = params["noise_strength"]
     
-    # Apply adversarial noise
-    noise = apply_adversarial_noise(image, params["noise_strength"])
-    protected_image = image + noise
+    # Frequency domain noise: image + noise with noise = spatial + 0.3 * (image + ifft(N)).
+    # The irfft2 output doubles as the scratch buffer for the later stages.
+    with span("noise"):
+        scratch = np.fft.irfft2(_noise_spectrum(work.shape, strength, rng), s=(rows, cols), axes=(0, 1))
+        # irfft2 over axes (0, 1) may return a non-C-contiguous array (numpy 1.x),
+        # which standard_normal(out=...) rejects
+        scratch = np.ascontiguousarray(scratch, dtype=np.float32)
+        scratch *= np.float32(0.3)
+        work *= np.float32(1.3)
+        work += scratch
+        
+        # Spatial domain noise
+        rng.standard_normal(dtype=np.float32, out=scratch)
+        scratch *= np.float32(strength)
+        work += scratch
     
-    # Apply gradient-based protection
-    protected_image = apply_gradient_based_protection(
-        protected_image, 
-        params["gradient_iterations"]
-    )
+    # Gradient-based protection: the sum of k independent unit-norm Gaussian
+    # steps is distributed like one unit-norm step scaled by sqrt(k)
+    iterations = params["gradient_iterations"]
+    if iterations > 0:
+        with span("gradient"):
+            rng.standard_normal(dtype=np.float32, out=scratch)
+            scratch *= np.float32(2.0 * np.sqrt(iterations) / (np.linalg.norm(scratch) + 1e-8))
+            work += scratch
+    del scratch
     
     # Enhance robustness for higher levels
     if params["enhance"]:
-        protected_image = enhance_robustness(protected_image)
+        with span("texture"):
+            texture = shape_cache.get("robustness_texture", rows, cols, work.dtype, _build_robustness_texture)
+            work += texture[:, :, np.newaxis]
     
     # Ensure valid pixel range
-    protected_image = np.clip(protected_image, 0, 255).astype(np.uint8)
+    np.clip(work, 0, 255, out=work)
+
+def _masked_fraction(rows: int, cols: int) -> float:
+    """Approximate share of spectrum bins passed by the high-pass mask"""
+    return 1.0 - np.pi * (min(rows, cols) // 4) ** 2 / (rows * cols)
+
+# Tiles overlap by tile_size // TILE_OVERLAP_DIVISOR pixels on each side
+TILE_OVERLAP_DIVISOR = 8
+
+def _tile_window(tile: int, overlap: int) -> np.ndarray:
+    """
+    Flat-top window with sine/cosine tapers over `overlap` samples at each end
+    Squared weights of neighbouring tiles sum to one across the overlap, so
+    blending independent noise tiles keeps the noise variance unchanged
+    """
+    window = np.ones(tile, dtype=np.float32)
+    ramp = np.sin(np.pi / 2 * (np.arange(overlap) + 0.5) / overlap)
+    window[:overlap] = ramp
+    window[tile - overlap:] = ramp[::-1]
+    return window
+
+def _tile_noise(tile: int, overlap: int, channels: int, strength: float, scale: float, seed_seq: np.random.SeedSequence) -> np.ndarray:
+    """
+    Windowed frequency-domain noise for one tile
+    Each tile has its own seed so results don't depend on scheduling order
+    """
+    with span("noise"):
+        rng = np.random.default_rng(seed_seq)
+        noise = np.fft.irfft2(
+            _noise_spectrum((tile, tile, channels), strength, rng),
+            s=(tile, tile),
+            axes=(0, 1)
+        ).astype(np.float32, copy=False)
+        
+        window = _tile_window(tile, overlap)
+        noise *= (window[:, np.newaxis] * (window * np.float32(scale))[np.newaxis, :])[:, :, np.newaxis]
+    return noise
+
+def _protect_tiled(image: np.ndarray, params: dict, rng: np.random.Generator, tile_size: int, workers: int = 1) -> np.ndarray:
+    """
+    Tiled version of _protect_in_place for very large images
+    Frequency noise is generated on overlapping tile_size x tile_size tiles and
+    blended with a tapered window; the pointwise stages then run one band of
+    rows at a time. Float working memory is O(tile_size * width) instead of
+    O(height * width), and tiles within a band run on `workers` threads.
+    Returns the protected uint8 image.
+    """
+    rows, cols, channels = image.shape
+    strength = params["noise_strength"]
+    iterations = params["gradient_iterations"]
+    
+    tile = max(tile_size, 2 * TILE_OVERLAP_DIVISOR)
+    overlap = tile // TILE_OVERLAP_DIVISOR
+    hop = tile - overlap
+    
+    # Per-tile and per-band generators all derive from one root entropy value
+    root_entropy = int(rng.integers(2 ** 63))
+    
+    # Full-image ifft noise has per-pixel std proportional to sqrt(masked bins) / (rows * cols);
+    # rescale the tile noise to match the whole-image statistics
+    scale = np.sqrt((tile * tile) / (rows * cols) * _masked_fraction(rows, cols) / _masked_fraction(tile, tile))
+    
+    # Norm of a Gaussian direction over the whole image, used by the gradient step
+    gradient_scale = np.float32(2.0 * np.sqrt(iterations) / (np.sqrt(image.size) + 1e-8))
+    
+    # Separable robustness texture, pre-scaled by its 0.5 weight
+    texture_y = np.sin(np.linspace(0, 50, rows)) * 0.5
+    texture_x = np.sin(np.linspace(0, 50, cols))
+    
+    # Tiles start at -overlap so the leading taper falls outside the image and
+    # every pixel gets full weight; tile i covers padded columns [i * hop, i * hop + tile)
+    x_origins = list(range(-overlap, cols, hop))
+    band = np.zeros((tile, (len(x_origins) - 1) * hop + tile, channels), dtype=np.float32)
+    output = np.empty(image.shape, dtype=np.uint8)
+    make_tile = partial(_tile_noise, tile, overlap, channels, strength, scale)
+    
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for band_index, y in enumerate(range(-overlap, rows, hop)):
+            seeds = [
+                np.random.SeedSequence(root_entropy, spawn_key=(0, band_index, i))
+                for i in range(len(x_origins))
+            ]
+            if executor:
+                # Each tile runs in a copy of this context so its spans reach the collector
+                futures = [executor.submit(copy_context().run, make_tile, seed) for seed in seeds]
+                tiles = (future.result() for future in futures)
+            else:
+                tiles = map(make_tile, seeds)
+            for i, noise in enumerate(tiles):
+                band[:, i * hop:i * hop + tile] += noise
+            
+            # Rows [y, y + hop) will not receive any more tiles
+            r0, r1 = max(y, 0), min(y + hop, rows)
+            if r0 < r1:
+                freq_noise = band[r0 - y:r1 - y, overlap:overlap + cols]
+                work = image[r0:r1].astype(np.float32)
+                band_rng = np.random.default_rng(np.random.SeedSequence(root_entropy, spawn_key=(1, band_index)))
+                
+                # Frequency and spatial domain noise
+                with span("noise"):
+                    freq_noise *= np.float32(0.3)
+                    work *= np.float32(1.3)
+                    work += freq_noise
+                    scratch = band_rng.standard_normal(work.shape, dtype=np.float32)
+                    scratch *= np.float32(strength)
+                    work += scratch
+                
+                # Gradient-based protection (single accumulated step)
+                if iterations > 0:
+                    with span("gradient"):
+                        band_rng.standard_normal(dtype=np.float32, out=scratch)
+                        scratch *= gradient_scale
+                        work += scratch
+                
+                # Enhance robustness for higher levels
+                if params["enhance"]:
+                    with span("texture"):
+                        work += (texture_y[r0:r1, np.newaxis] * texture_x[np.newaxis, :]).astype(np.float32)[:, :, np.newaxis]
+                
+                np.clip(work, 0, 255, out=work)
+                output[r0:r1] = work
+            
+            # Slide the band down by one hop, keeping the overlap rows
+            band[:overlap] = band[hop:]
+            band[overlap:] = 0
+    finally:
+        if executor:
+            executor.shutdown()
+    
+    return output
+
+@timed("protect")
+def protect_image(
+    image: np.ndarray,
+    level: str,
+    in_place: bool = True,
+    rng: Optional[np.random.Generator] = None,
+    seed: Optional[int] = None,
+    tile_size: Optional[int] = None,
+    tile_workers: int = 1
+) -> Tuple[np.ndarray, dict]:
+    """
+    Apply comprehensive image protection based on level
+    in_place=True runs all stages on one preallocated float32 buffer, cutting
+    peak memory several times; in_place=False composes the standalone stage
+    functions and is kept as the reference implementation
+    tile_size switches to tiled processing with bounded memory for very large
+    images, using tile_workers threads per band of tiles
+    Noise comes from `rng`, or from a new generator seeded with `seed`
+    (recorded in the metadata) for reproducible runs
+    Returns: (protected_image, processing_metadata)
+    """
+    if image is None:
+        raise ValueError("No image data to protect")
+    
+    params = PROTECTION_PARAMS.get(level, PROTECTION_PARAMS["LOW"])
+    if rng is None:
+        rng = create_rng(seed)
+    
+    if tile_size:
+        protected_image = _protect_tiled(image, params, rng, tile_size, tile_workers)
+    elif in_place:
+        protected_image = image.astype(np.float32)
+        _protect_in_place(protected_image, params, rng)
+        protected_image = protected_image.astype(np.uint8)
+    else:
+        image = image.astype(np.float32)
+        
+        # Apply adversarial noise
+        noise = apply_adversarial_noise(image, params["noise_strength"], rng)
+        protected_image = image + noise
+        
+        # Apply gradient-based protection
+        protected_image = apply_gradient_based_protection(
+            protected_image, 
+            params["gradient_iterations"],
+            rng
+        )
+        
+        # Enhance robustness for higher levels
+        if params["enhance"]:
+            protected_image = enhance_robustness(protected_image)
+        
+        # Ensure valid pixel range
+        protected_image = np.clip(protected_image, 0, 255).astype(np.uint8)
     
     metadata = {
         "protection_level": level,
         "noise_strength": params["noise_strength"],
         "gradient_iterations": params["gradient_iterations"],
-        "robustness_enhanced": params["enhance"]
+        "robustness_enhanced": params["enhance"],
+        "rng": type(rng.bit_generator).__name__,
+        "tile_size": tile_size
     }
+    if seed is not None:
+        metadata["noise_seed"] = seed
     
     return protected_image, metadata
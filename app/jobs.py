@@ -0,0 +1,305 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Relative cost of each protection level, used to order the queue
+LEVEL_COST = {"LOW": 1.0, "MEDIUM": 1.5, "HIGH": 2.0}
+
+def job_priority(level_estimate: str, pixels: int) -> float:
+    """
+    Expected cost of a job; cheaper jobs run first
+    Small, low-level images finish quickly, so running them ahead of large
+    HIGH-level scans keeps the queue moving for everyone. JobStore ages
+    waiting jobs so expensive ones still run under a steady stream of cheap ones
+    """
+    return pixels * LEVEL_COST.get(level_estimate, LEVEL_COST["HIGH"])
+
+class JobStore:
+    """
+    SQLite-backed store for queued, running and finished protection jobs
+    Inputs and results are kept as BLOBs; all access goes through one
+    connection guarded by a lock, so it is safe to call from worker threads
+    Several processes can share one database: each store claims jobs under
+    its own worker id with a lease of `lease_seconds`, which the scheduler
+    renews while the job runs; only jobs whose lease ran out are requeued
+    Every second a job waits lowers its priority by `aging_rate` (in
+    job_priority's units), so no job is skipped forever
+    """
+    
+    def __init__(self, path: str, lease_seconds: float = 60.0, aging_rate: float = 0.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.aging_rate = aging_rate
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10.0)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    priority REAL NOT NULL,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    filename TEXT,
+                    owner_id TEXT NOT NULL,
+                    cacheable INTEGER NOT NULL,
+                    seed INTEGER,
+                    image_info TEXT,
+                    encode_options TEXT,
+                    input BLOB,
+                    result BLOB,
+                    protection_level TEXT,
+                    metadata TEXT,
+                    error TEXT,
+                    worker TEXT,
+                    lease_expires REAL
+                )
+            """)
+            # Databases created before leases existed
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("worker", "TEXT"), ("lease_expires", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, created)")
+        # Jobs whose worker died go back to the queue; live workers keep theirs
+        self.requeue_expired()
+    
+    def submit(
+        self,
+        data: bytes,
+        filename: Optional[str],
+        owner_id: str,
+        cacheable: bool,
+        seed: Optional[int],
+        image_info: Optional[Dict],
+        priority: float,
+        encode_options: Optional[Dict] = None
+    ) -> str:
+        """Queue a job and return its id"""
+        job_id = str(uuid.uuid4())
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, priority, created, filename, owner_id, cacheable, seed, image_info, "
+                "encode_options, input) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, priority, time.time(), filename, owner_id, int(cacheable), seed,
+                 json.dumps(image_info), json.dumps(encode_options), sqlite3.Binary(data))
+            )
+        return job_id
+    
+    def claim_next(self) -> Optional[sqlite3.Row]:
+        """
+        Mark the cheapest queued job as running under this worker and return it
+        Cost is aged by waiting time: priority - aging_rate * (now - created),
+        which orders the same as priority + aging_rate * created
+        The UPDATE only succeeds while the job is still queued, so when
+        processes race for the same job exactly one of them gets it
+        """
+        with self._lock:
+            while True:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority + ? * created, created LIMIT 1",
+                    (self.aging_rate,)
+                ).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                with self._conn:
+                    claimed = self._conn.execute(
+                        "UPDATE jobs SET status = 'running', started = ?, worker = ?, lease_expires = ? "
+                        "WHERE id = ? AND status = 'queued'",
+                        (now, self.worker_id, now + self.lease_seconds, row["id"])
+                    ).rowcount
+                if claimed:
+                    return row
+    
+    def renew(self, job_id: str) -> bool:
+        """Extend the lease on a job this worker is running; False if it was lost"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time() + self.lease_seconds, job_id, self.worker_id)
+            ).rowcount > 0
+    
+    def requeue(self, job_id: str):
+        """Put a claimed job back on the queue (e.g. the worker pool was full)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL, worker = NULL, lease_expires = NULL "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (job_id, self.worker_id)
+            )
+    
+    def requeue_expired(self) -> int:
+        """Requeue running jobs whose lease has run out (their worker died)"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL, worker = NULL, lease_expires = NULL "
+                "WHERE status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)",
+                (time.time(),)
+            ).rowcount
+    
+    def complete(self, job_id: str, protection_level: str, image_bytes: bytes, metadata: Dict):
+        """Store a finished job's result and drop its input (unless the job was reassigned)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', finished = ?, result = ?, protection_level = ?, "
+                "metadata = ?, input = NULL, lease_expires = NULL WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time(), sqlite3.Binary(image_bytes), protection_level, json.dumps(metadata, default=str),
+                 job_id, self.worker_id)
+            )
+    
+    def fail(self, job_id: str, error: str):
+        """Record a failed job and drop its input (unless the job was reassigned)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', finished = ?, error = ?, input = NULL, lease_expires = NULL "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time(), error, job_id, self.worker_id)
+            )
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Status of one job (without input/result payloads)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, priority, created, started, finished, filename, protection_level, "
+                "metadata, error FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        return dict(row) if row is not None else None
+    
+    def get_result(self, job_id: str) -> Optional[bytes]:
+        """Encoded image bytes of a finished job"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM jobs WHERE id = ? AND status = 'done'", (job_id,)
+            ).fetchone()
+        return bytes(row["result"]) if row is not None else None
+    
+    def queued_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+    
+    def purge_finished(self, older_than: float) -> int:
+        """Delete finished and failed jobs that ended before `older_than`"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?", (older_than,)
+            )
+            return cursor.rowcount
+    
+    def counts(self) -> Dict:
+        """Number of jobs per status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Runs one claimed job: (data, filename, owner_id, cacheable, seed, image_info, encode_options)
+# -> (level, image_bytes, metadata)
+JobRunner = Callable[..., Awaitable[Tuple[str, bytes, Dict]]]
+
+class BusyRetry(Exception):
+    """Raised by a job runner when the job should go back on the queue"""
+
+class JobScheduler:
+    """
+    Background loop pulling jobs from a JobStore in priority order
+    Runs up to `concurrency` jobs at a time and purges results older than
+    `retention_seconds`
+    """
+    
+    def __init__(self, store: JobStore, runner: JobRunner, concurrency: int = 2,
+                 retention_seconds: float = 3600, poll_interval: float = 1.0):
+        self.store = store
+        self.runner = runner
+        self.concurrency = concurrency
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = []
+    
+    def start(self):
+        """Start the worker loops and the retention sweeper on the running event loop"""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def notify(self):
+        """Wake idle workers after a new job is queued"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def _worker(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim_next)
+            if job is None:
+                # Sleep until a submit wakes us up (or poll as a fallback)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+            try:
+                image_info = json.loads(job["image_info"]) if job["image_info"] else None
+                encode_options = json.loads(job["encode_options"]) if job["encode_options"] else None
+                protection_level, image_bytes, metadata = await self.runner(
+                    bytes(job["input"]), job["filename"], job["owner_id"],
+                    bool(job["cacheable"]), job["seed"], image_info, encode_options
+                )
+            except BusyRetry:
+                await asyncio.to_thread(self.store.requeue, job["id"])
+                await asyncio.sleep(self.poll_interval)
+                continue
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.store.requeue, job["id"])
+                raise
+            except Exception as e:
+                logger.error(f"Job {job['id']} failed: {str(e)}", exc_info=True)
+                await asyncio.to_thread(self.store.fail, job["id"], str(e))
+                continue
+            finally:
+                heartbeat.cancel()
+            
+            await asyncio.to_thread(self.store.complete, job["id"], protection_level, image_bytes, metadata)
+    
+    async def _heartbeat(self, job_id: str):
+        """Keep renewing a running job's lease so other workers leave it alone"""
+        while True:
+            await asyncio.sleep(self.store.lease_seconds / 3)
+            if not await asyncio.to_thread(self.store.renew, job_id):
+                logger.warning(f"Lost the lease on job {job_id}")
+                return
+    
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(min(self.retention_seconds, self.store.lease_seconds, 60))
+            requeued = await asyncio.to_thread(self.store.requeue_expired)
+            if requeued:
+                logger.info(f"Requeued {requeued} jobs from workers that stopped")
+            purged = await asyncio.to_thread(self.store.purge_finished, time.time() - self.retention_seconds)
+            if purged:
+                logger.info(f"Purged {purged} expired jobs")
@@ -1,20 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+import asyncio
+import json
 import uuid
+import zipfile
 import os
-import shutil
 import time
 import logging
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional, Tuple
+from urllib.parse import quote
 
-from app.agent import decide_protection_level
-from app.image_protect import protect_image
-from app.watermark import add_watermark, verify_watermark
+from app.agent import decision_cache, filename_risk_level
+from app.analytics import create_analytics, prometheus_text
+from app.jobs import BusyRetry, JobScheduler, JobStore, job_priority
+from app.output_store import OutputSweeper, create_output_store
+from app.pipeline import ImageDecodeError, run_protection, run_verification
+from app.probe import probe_image
+from app.result_cache import CachedResult, create_result_cache, result_cache_key
+from app.shape_cache import shape_cache
+from app.timing import server_timing_header
+from app.upload_limits import MULTIPART_OVERHEAD_BYTES, UploadSizeLimitMiddleware, read_upload
+from app.warmup import prepare_service, warmup_state
+from app.watermark import (
+    DEFAULT_ENCODE_OPTIONS, OUTPUT_FORMATS, EncodeOptions, check_encode_dimensions, make_encode_options
+)
+from app.workers import PoolBusyError, ProtectionPool
 
 # Configure logging
 logging.basicConfig(
@@ -30,12 +45,74 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Rate limiting
-limiter = Limiter(key_func=get_remote_address)
+# Rate limiting (RATE_LIMIT_ENABLED=false turns it off, e.g. for load tests)
+limiter = Limiter(
+    key_func=get_remote_address,
+    enabled=os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# CORS Configuration
+UPLOAD_DIR = "temp"
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# Worker pool for CPU-bound protection work (thread or process)
+WORKER_MODE = os.getenv("WORKER_MODE", "thread")
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "0")) or None  # 0 -> one per CPU
+WORKER_QUEUE_DEPTH = int(os.getenv("WORKER_QUEUE_DEPTH", "8"))
+
+protection_pool = ProtectionPool(WORKER_MODE, WORKER_COUNT, WORKER_QUEUE_DEPTH)
+
+# Content-addressed cache of protected images (memory, disk or none)
+result_cache = create_result_cache(
+    os.getenv("RESULT_CACHE_BACKEND", "memory"),
+    int(float(os.getenv("RESULT_CACHE_MB", "256")) * 1024 * 1024),
+    float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600")),
+    os.getenv("RESULT_CACHE_DIR", os.path.join(UPLOAD_DIR, "result_cache"))
+)
+
+# Protected outputs kept for re-download via GET /images/{image_id} (disk or none)
+output_store = create_output_store(
+    os.getenv("OUTPUT_STORE_BACKEND", "none"),
+    os.getenv("OUTPUT_STORE_DIR", os.path.join(UPLOAD_DIR, "outputs")),
+    int(float(os.getenv("OUTPUT_STORE_MB", "1024")) * 1024 * 1024),
+    float(os.getenv("OUTPUT_STORE_TTL_SECONDS", "3600"))
+)
+output_sweeper = (
+    OutputSweeper(output_store, float(os.getenv("OUTPUT_STORE_SWEEP_SECONDS", "60")))
+    if output_store is not None else None
+)
+
+# Most files accepted by /protect-images/batch
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "20"))
+
+# Background job queue for POST /jobs (SQLite-backed)
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(UPLOAD_DIR, "jobs", "jobs.db"))
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "100"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+# Running jobs are requeued if their worker stops renewing the lease for this long
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Priority (weighted pixels) a queued job gains per second waited, so large jobs aren't starved
+JOB_AGING_RATE = float(os.getenv("JOB_AGING_RATE", "100000"))
+
+os.makedirs(os.path.dirname(JOB_DB_PATH) or ".", exist_ok=True)
+job_store = JobStore(JOB_DB_PATH, JOB_LEASE_SECONDS, JOB_AGING_RATE)
+
+# Largest decoded image accepted (guards against decompression bombs)
+MAX_IMAGE_PIXELS = int(float(os.getenv("MAX_IMAGE_MEGAPIXELS", "100")) * 1_000_000)
+
+# Largest upload accepted per file; request bodies are capped while streaming
+MAX_FILE_SIZE = int(float(os.getenv("MAX_FILE_SIZE_MB", "10")) * 1024 * 1024)
+
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_body_bytes=MAX_FILE_SIZE + MULTIPART_OVERHEAD_BYTES,
+    path_limits={"/protect-images/batch": MAX_BATCH_FILES * (MAX_FILE_SIZE + MULTIPART_OVERHEAD_BYTES)}
+)
+
+# CORS Configuration (added last so it is outermost and 413s from the
+# upload limit still carry CORS headers)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # In production, specify your frontend domain
@@ -44,29 +121,208 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOAD_DIR = "temp"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Rolling analytics: per-process memory, or a SQLite file shared by all workers
+analytics = create_analytics(
+    os.getenv("ANALYTICS_BACKEND", "memory"),
+    int(os.getenv("ANALYTICS_RECENT_SIZE", "1000")),
+    os.getenv("ANALYTICS_DB_PATH", os.path.join(UPLOAD_DIR, "analytics", "analytics.db"))
+)
 
-# Analytics storage (in production, use proper database)
-analytics_log = []
+# Return per-stage durations in a Server-Timing header on /protect-image
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
 
-def log_analytics(data: dict):
-    """Log processing metrics"""
-    analytics_log.append(data)
+async def log_analytics(data: dict):
+    """
+    Log processing metrics
+    Recording runs off the event loop (the SQLite backend may wait on other
+    workers' writes) and a failure never affects the response
+    """
+    try:
+        await asyncio.to_thread(analytics.record, data)
+    except Exception as e:
+        logger.warning(f"Could not record analytics: {e}")
     logger.info(f"Analytics: {data}")
+
+def content_disposition(filename: str) -> str:
+    """Build an attachment Content-Disposition header for a download name"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+class ZipStream:
+    """
+    Write-only sink so zipfile can emit an archive incrementally
+    zipfile falls back to streaming mode (data descriptors) when the target
+    can't seek, and drain() hands back whatever has been written so far
+    """
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def read_image_upload(file: UploadFile) -> bytes:
+    """
+    Check the content type of an upload and read it in size-limited chunks
+    Raises 400 if it is not an image or is too large
+    """
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    return await read_upload(file, MAX_FILE_SIZE)
+
+def validate_image_header(data: bytes) -> dict:
+    """
+    Check format and dimensions from the image header, before any pixel decode
+    Raises 400 for unsupported formats and oversized (decompression bomb) images
+    """
+    image_info = probe_image(data)
+    if image_info is None:
+        raise HTTPException(status_code=400, detail="Unsupported image format. Use PNG, JPEG or WebP")
     
-    # Keep only last 1000 entries
-    if len(analytics_log) > 1000:
-        analytics_log.pop(0)
+    pixels = image_info["width"] * image_info["height"]
+    if pixels > MAX_IMAGE_PIXELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Image dimensions too large. Max: {MAX_IMAGE_PIXELS // 1_000_000} megapixels"
+        )
+    return image_info
+
+def parse_encode_options(
+    output_format: Optional[str],
+    png_compression: Optional[int],
+    png_fast_filters: Optional[bool]
+) -> EncodeOptions:
+    """
+    Per-request output options over the server defaults
+    Raises 400 for lossy or unknown formats and bad PNG levels
+    """
+    try:
+        return make_encode_options(output_format, png_compression, png_fast_filters, DEFAULT_ENCODE_OPTIONS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-def cleanup_temp_files(image_id: str):
-    """Remove temporary files after processing"""
+def check_output_size(encode_options: EncodeOptions, image_info: dict):
+    """Raise 400 if the image is too large for the requested output format"""
     try:
-        input_path = f"{UPLOAD_DIR}/{image_id}_input.png"
-        if os.path.exists(input_path):
-            os.remove(input_path)
-    except Exception as e:
-        logger.warning(f"Failed to cleanup temp files: {e}")
+        check_encode_dimensions(encode_options, image_info["width"], image_info["height"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def output_filename(filename: Optional[str], output_format: str, fallback: str = "image") -> str:
+    """Download name for a protected image: protected_<stem>.<format extension>"""
+    stem = os.path.splitext(os.path.basename(filename or ""))[0] or fallback
+    return f"protected_{stem}{OUTPUT_FORMATS[output_format][1]}"
+
+async def store_output(
+    image_id: str,
+    image_bytes: bytes,
+    encode_options: EncodeOptions,
+    filename: str,
+    protection_level: str
+) -> Optional[str]:
+    """
+    Keep a protected image in the output store for re-download
+    Returns its /images URL, or None if the store is off or the write failed
+    """
+    if output_store is None:
+        return None
+    try:
+        stored = await asyncio.to_thread(
+            output_store.put, image_id, image_bytes, OUTPUT_FORMATS[encode_options.format][0],
+            filename, protection_level
+        )
+    except OSError as e:
+        logger.warning(f"Could not store output {image_id}: {e}")
+        return None
+    return f"/images/{image_id}" if stored else None
+
+def server_busy_error() -> HTTPException:
+    """503 backpressure response used when the worker pool is full"""
+    return HTTPException(
+        status_code=503,
+        detail="Server busy, please retry shortly",
+        headers={"Retry-After": "1"}
+    )
+
+async def protect_upload(
+    data: bytes,
+    filename: Optional[str],
+    owner_id: str,
+    cacheable: bool,
+    seed: Optional[int] = None,
+    image_info: Optional[dict] = None,
+    encode_options: Optional[EncodeOptions] = None
+) -> Tuple[str, bytes, dict, bool]:
+    """
+    Protect one validated upload, going through the result cache when allowed
+    Returns: (protection_level, image_bytes, pipeline_metadata, cache_hit)
+    """
+    encode_options = encode_options or DEFAULT_ENCODE_OPTIONS
+    
+    # Repeat uploads from the same owner are served from the result cache.
+    # Anonymous uploads get a fresh owner id, so they are never cacheable.
+    cache_key = None
+    if result_cache is not None and cacheable:
+        cache_key = result_cache_key(
+            data, filename_risk_level(filename or ""), owner_id, seed, repr(tuple(encode_options))
+        )
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+        if cached is not None:
+            return (*cached, True)
+    
+    # Decode, agent decision, protection and watermarking all run on the
+    # worker pool so the event loop stays free for other requests
+    protection_level, image_bytes, pipeline_metadata = await protection_pool.run(
+        run_protection, data, filename, owner_id, seed, image_info, encode_options
+    )
+    if cache_key is not None:
+        await asyncio.to_thread(
+            result_cache.set, cache_key, CachedResult(protection_level, image_bytes, pipeline_metadata)
+        )
+    return protection_level, image_bytes, pipeline_metadata, False
+
+async def run_job(
+    data: bytes,
+    filename: Optional[str],
+    owner_id: str,
+    cacheable: bool,
+    seed: Optional[int],
+    image_info: Optional[dict],
+    encode_options: Optional[dict]
+) -> Tuple[str, bytes, dict]:
+    """Job scheduler runner: protect a queued upload and log its analytics"""
+    start_time = time.time()
+    try:
+        protection_level, image_bytes, pipeline_metadata, cache_hit = await protect_upload(
+            data, filename, owner_id, cacheable, seed, image_info,
+            EncodeOptions(**encode_options) if encode_options else None
+        )
+    except PoolBusyError:
+        raise BusyRetry()
+    
+    await log_analytics({
+        "timestamp": datetime.utcnow().isoformat(),
+        "processing_time_ms": round((time.time() - start_time) * 1000, 2),
+        "protection_level": protection_level,
+        "file_size_kb": round(len(data) / 1024, 2),
+        "source": "job",
+        **pipeline_metadata,
+        "cache_hit": cache_hit
+    })
+    return protection_level, image_bytes, pipeline_metadata
+
+job_scheduler = JobScheduler(job_store, run_job, JOB_CONCURRENCY, JOB_RETENTION_SECONDS)
 
 @app.get("/")
 async def root():
@@ -78,18 +334,31 @@ async def root():
         "timestamp": datetime.utcnow().isoformat()
     }
 
+@app.get("/ready")
+async def ready():
+    """Readiness check: 503 until the pipeline and every pool worker are warmed up"""
+    return JSONResponse(status_code=200 if warmup_state["ready"] else 503, content=warmup_state)
+
 @app.post("/protect-image")
 @limiter.limit("10/minute")  # Rate limit: 10 requests per minute
 async def protect_image_api(
     request: Request,
     file: UploadFile = File(...),
-    user_id: Optional[str] = None
+    user_id: Optional[str] = None,
+    seed: Optional[int] = Query(None, ge=0, le=2**63 - 1),
+    output_format: Optional[str] = None,
+    png_compression: Optional[int] = None,
+    png_fast_filters: Optional[bool] = None
 ):
     """
     Main endpoint to protect images
     
-    - **file**: Image file to protect (PNG, JPG, JPEG)
+    - **file**: Image file to protect (PNG, JPG, JPEG, WebP)
     - **user_id**: Optional user identifier for watermarking
+    - **seed**: Optional noise seed for reproducible protection (recorded in analytics)
+    - **output_format**: png or webp (lossless); lossy formats are refused
+    - **png_compression**: PNG zlib level 0-9 (lower is faster, slightly larger)
+    - **png_fast_filters**: Use OpenCV's fast PNG filter selection
     
     Returns protected image with invisible watermark
     """
@@ -97,38 +366,21 @@ async def protect_image_api(
     image_id = str(uuid.uuid4())
     
     try:
-        # Validate file type
-        if not file.content_type or not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Validate file size (max 10MB for hackathon demo)
-        file.file.seek(0, 2)
-        file_size = file.file.tell()
-        file.file.seek(0)
-        
-        if file_size > 10 * 1024 * 1024:  # 10MB
-            raise HTTPException(status_code=400, detail="File too large. Max size: 10MB")
+        encode_options = parse_encode_options(output_format, png_compression, png_fast_filters)
+        data = await read_image_upload(file)
+        file_size = len(data)
         
         logger.info(f"Processing image: {file.filename}, Size: {file_size} bytes, ID: {image_id}")
         
-        # Save uploaded file
-        input_path = f"{UPLOAD_DIR}/{image_id}_input.png"
-        output_path = f"{UPLOAD_DIR}/{image_id}_protected.png"
+        # Reject unsupported or oversized images from the header alone
+        image_info = validate_image_header(data)
+        check_output_size(encode_options, image_info)
         
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Agentic decision making
-        protection_level, agent_metadata = decide_protection_level(input_path, file.filename)
+        protection_level, image_bytes, pipeline_metadata, cache_hit = await protect_upload(
+            data, file.filename, user_id or image_id, bool(user_id), seed, image_info, encode_options
+        )
         logger.info(f"Protection level decided: {protection_level}")
         
-        # Apply AI protection
-        protected_img, protection_metadata = protect_image(input_path, protection_level)
-        
-        # Add watermark with user/owner ID
-        owner_id = user_id or image_id
-        final_image_path = add_watermark(protected_img, owner_id, output_path, consent=True)
-        
         # Calculate processing time
         processing_time = time.time() - start_time
         
@@ -139,34 +391,173 @@ async def protect_image_api(
             "protection_level": protection_level,
             "file_size_kb": round(file_size / 1024, 2),
             "image_id": image_id[:8],  # Truncated for privacy
-            **agent_metadata,
-            **protection_metadata
+            **pipeline_metadata,
+            "cache_hit": cache_hit
         }
-        log_analytics(analytics_data)
-        
-        # Cleanup input file
-        cleanup_temp_files(image_id)
+        await log_analytics(analytics_data)
         
         logger.info(f"Image protected successfully in {processing_time:.2f}s")
         
-        return FileResponse(
-            path=final_image_path,
-            media_type="image/png",
-            filename=f"protected_{file.filename}",
-            headers={
-                "X-Protection-Level": protection_level,
-                "X-Processing-Time": str(round(processing_time * 1000, 2)),
-                "X-Image-ID": image_id
-            }
+        download_name = output_filename(file.filename, encode_options.format)
+        image_url = await store_output(image_id, image_bytes, encode_options, download_name, protection_level)
+        
+        headers = {
+            "Content-Disposition": content_disposition(download_name),
+            "X-Protection-Level": protection_level,
+            "X-Processing-Time": str(round(processing_time * 1000, 2)),
+            "X-Image-ID": image_id,
+            "X-Cache": "HIT" if cache_hit else "MISS",
+            "X-Encode-Time": str(pipeline_metadata["encode_time_ms"]),
+            "X-Output-Size": str(len(image_bytes))
+        }
+        if image_url:
+            headers["X-Image-URL"] = image_url
+        if SERVER_TIMING_HEADER:
+            stage_timings = {} if cache_hit else pipeline_metadata.get("stage_timings_ms", {})
+            headers["Server-Timing"] = server_timing_header({**stage_timings, "total": processing_time * 1000})
+        
+        return Response(
+            content=image_bytes,
+            media_type=OUTPUT_FORMATS[encode_options.format][0],
+            headers=headers
         )
     
     except HTTPException:
         raise
+    except PoolBusyError:
+        logger.warning(f"Worker pool full, rejecting image {image_id}")
+        raise server_busy_error()
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}", exc_info=True)
-        cleanup_temp_files(image_id)
         raise HTTPException(status_code=500, detail=f"Image processing failed: {str(e)}")
 
+@app.post("/protect-images/batch")
+@limiter.limit("5/minute")
+async def protect_images_batch_api(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    user_id: Optional[str] = None,
+    output_format: Optional[str] = None,
+    png_compression: Optional[int] = None,
+    png_fast_filters: Optional[bool] = None
+):
+    """
+    Protect many images in one request
+    
+    - **files**: Image files to protect (PNG, JPG, JPEG, WebP)
+    - **user_id**: Optional user identifier for watermarking
+    - **output_format**, **png_compression**, **png_fast_filters**: as for /protect-image
+    
+    Images are processed concurrently on the worker pool. The response is a
+    zip streamed as each image finishes, ending with a manifest.json that
+    lists per-image status, protection level and timing.
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files. Max per batch: {MAX_BATCH_FILES}")
+    encode_options = parse_encode_options(output_format, png_compression, png_fast_filters)
+    
+    batch_id = str(uuid.uuid4())
+    batch_start = time.time()
+    
+    # A batch never takes more than one slot per worker, so it can't fill the
+    # pool's queue and starve single-image requests
+    slots = asyncio.Semaphore(protection_pool.workers)
+    
+    async def process(index: int, file: UploadFile) -> Tuple[dict, Optional[bytes]]:
+        image_id = str(uuid.uuid4())
+        entry = {"index": index, "filename": file.filename, "image_id": image_id}
+        
+        async with slots:
+            start_time = time.time()
+            try:
+                data = await read_image_upload(file)
+                file_size = len(data)
+                image_info = validate_image_header(data)
+                check_output_size(encode_options, image_info)
+                protection_level, image_bytes, pipeline_metadata, cache_hit = await protect_upload(
+                    data, file.filename, user_id or image_id, bool(user_id), None, image_info, encode_options
+                )
+            except HTTPException as e:
+                entry.update(status="error", detail=e.detail)
+                return entry, None
+            except PoolBusyError:
+                entry.update(status="error", detail="Server busy, please retry shortly")
+                return entry, None
+            except ImageDecodeError as e:
+                entry.update(status="error", detail=str(e))
+                return entry, None
+            except Exception as e:
+                logger.error(f"Error processing batch image {index}: {str(e)}", exc_info=True)
+                entry.update(status="error", detail=f"Image processing failed: {str(e)}")
+                return entry, None
+        
+        processing_time_ms = round((time.time() - start_time) * 1000, 2)
+        await log_analytics({
+            "timestamp": datetime.utcnow().isoformat(),
+            "processing_time_ms": processing_time_ms,
+            "protection_level": protection_level,
+            "file_size_kb": round(file_size / 1024, 2),
+            "image_id": image_id[:8],  # Truncated for privacy
+            "batch_id": batch_id[:8],
+            **pipeline_metadata,
+            "cache_hit": cache_hit
+        })
+        download_name = output_filename(file.filename, encode_options.format, f"image_{index}")
+        image_url = await store_output(image_id, image_bytes, encode_options, download_name, protection_level)
+        if image_url:
+            entry["image_url"] = image_url
+        entry.update(
+            status="ok",
+            output=f"{index:03d}_{download_name}",
+            protection_level=protection_level,
+            processing_time_ms=processing_time_ms,
+            encode_time_ms=pipeline_metadata["encode_time_ms"],
+            output_bytes=len(image_bytes),
+            cache="HIT" if cache_hit else "MISS"
+        )
+        return entry, image_bytes
+    
+    async def stream_archive():
+        sink = ZipStream()
+        manifest = []
+        tasks = [asyncio.create_task(process(i, f)) for i, f in enumerate(files)]
+        try:
+            with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+                # Images are already compressed, so entries are stored as-is
+                for next_done in asyncio.as_completed(tasks):
+                    entry, image_bytes = await next_done
+                    if image_bytes is not None:
+                        archive.writestr(entry["output"], image_bytes)
+                    manifest.append(entry)
+                    yield sink.drain()
+                
+                archive.writestr("manifest.json", json.dumps({
+                    "batch_id": batch_id,
+                    "total_time_ms": round((time.time() - batch_start) * 1000, 2),
+                    "succeeded": sum(1 for entry in manifest if entry["status"] == "ok"),
+                    "failed": sum(1 for entry in manifest if entry["status"] != "ok"),
+                    "images": sorted(manifest, key=lambda entry: entry["index"])
+                }, indent=2))
+            yield sink.drain()
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    logger.info(f"Processing batch {batch_id} with {len(files)} images")
+    
+    return StreamingResponse(
+        stream_archive(),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": content_disposition(f"protected_batch_{batch_id[:8]}.zip"),
+            "X-Batch-ID": batch_id
+        }
+    )
+
 @app.post("/verify-watermark")
 @limiter.limit("20/minute")
 async def verify_watermark_api(request: Request, file: UploadFile = File(...)):
@@ -175,20 +566,11 @@ async def verify_watermark_api(request: Request, file: UploadFile = File(...)):
     
     Returns watermark metadata if present
     """
-    temp_id = str(uuid.uuid4())
-    temp_path = f"{UPLOAD_DIR}/{temp_id}_verify.png"
-    
     try:
-        # Save uploaded file
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Extract watermark
-        watermark_data = verify_watermark(temp_path)
-        
-        # Cleanup
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        # Validate the header, then decode and extract off the event loop
+        data = await read_upload(file, MAX_FILE_SIZE)
+        validate_image_header(data)
+        watermark_data = await protection_pool.run(run_verification, data)
         
         if watermark_data:
             return JSONResponse(content={
@@ -201,39 +583,166 @@ async def verify_watermark_api(request: Request, file: UploadFile = File(...)):
                 "metadata": None
             })
     
+    except HTTPException:
+        raise
+    except PoolBusyError:
+        raise server_busy_error()
     except Exception as e:
         logger.error(f"Error verifying watermark: {str(e)}")
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         raise HTTPException(status_code=500, detail="Watermark verification failed")
 
+@app.post("/jobs", status_code=202)
+@limiter.limit("10/minute")
+async def create_job_api(
+    request: Request,
+    file: UploadFile = File(...),
+    user_id: Optional[str] = None,
+    seed: Optional[int] = Query(None, ge=0, le=2**63 - 1),
+    output_format: Optional[str] = None,
+    png_compression: Optional[int] = None,
+    png_fast_filters: Optional[bool] = None
+):
+    """
+    Queue an image for protection and return immediately
+    
+    - **file**: Image file to protect (PNG, JPG, JPEG, WebP)
+    - **user_id**: Optional user identifier for watermarking
+    - **seed**: Optional noise seed for reproducible protection
+    - **output_format**, **png_compression**, **png_fast_filters**: as for /protect-image
+    
+    Poll GET /jobs/{job_id} for status; download from GET /jobs/{job_id}/result.
+    Cheaper jobs (small images, low filename risk) are scheduled first.
+    """
+    encode_options = parse_encode_options(output_format, png_compression, png_fast_filters)
+    data = await read_image_upload(file)
+    image_info = validate_image_header(data)
+    check_output_size(encode_options, image_info)
+    
+    queued = await asyncio.to_thread(job_store.queued_count)
+    if queued >= JOB_MAX_QUEUED:
+        raise server_busy_error()
+    
+    job_owner = user_id or str(uuid.uuid4())
+    priority = job_priority(filename_risk_level(file.filename or ""), image_info["width"] * image_info["height"])
+    job_id = await asyncio.to_thread(
+        job_store.submit, data, file.filename, job_owner, bool(user_id), seed, image_info, priority,
+        encode_options._asdict()
+    )
+    job_scheduler.notify()
+    
+    logger.info(f"Queued job {job_id}: {file.filename}, {len(data)} bytes")
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job_api(job_id: str):
+    """
+    Status of a queued protection job
+    
+    Status is one of queued, running, done or failed; finished jobs include
+    the protection level and a result_url until they expire
+    """
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    response = {
+        "job_id": job_id,
+        "status": job["status"],
+        "filename": job["filename"],
+        "created_at": datetime.utcfromtimestamp(job["created"]).isoformat()
+    }
+    if job["started"] is not None:
+        response["started_at"] = datetime.utcfromtimestamp(job["started"]).isoformat()
+    if job["finished"] is not None:
+        response["finished_at"] = datetime.utcfromtimestamp(job["finished"]).isoformat()
+        response["processing_time_ms"] = round((job["finished"] - job["started"]) * 1000, 2)
+    if job["status"] == "done":
+        response["protection_level"] = job["protection_level"]
+        response["metadata"] = json.loads(job["metadata"])
+        response["result_url"] = f"/jobs/{job_id}/result"
+    if job["status"] == "failed":
+        response["error"] = job["error"]
+    return response
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result_api(job_id: str):
+    """
+    Download the protected image of a finished job
+    """
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    
+    image_bytes = await asyncio.to_thread(job_store.get_result, job_id)
+    if image_bytes is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    output_format = json.loads(job["metadata"]).get("output_format", "png")
+    return Response(
+        content=image_bytes,
+        media_type=OUTPUT_FORMATS[output_format][0],
+        headers={
+            "Content-Disposition": content_disposition(output_filename(job["filename"], output_format, job_id)),
+            "X-Protection-Level": job["protection_level"],
+            "X-Job-ID": job_id
+        }
+    )
+
+@app.get("/images/{image_id}")
+async def get_image(image_id: str, request: Request):
+    """
+    Re-download a protected image by its X-Image-ID
+    Supports If-None-Match (304) and Range requests; 404 once the image has
+    expired or when the output store is disabled
+    """
+    stored = await asyncio.to_thread(output_store.get, image_id) if output_store is not None else None
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    max_age = max(0, int(stored.created + output_store.ttl_seconds - time.time()))
+    headers = {"ETag": stored.etag, "Cache-Control": f"private, max-age={max_age}"}
+    # Weak comparison, as If-None-Match requires
+    client_tags = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    client_tags = [tag[2:] if tag.startswith("W/") else tag for tag in client_tags]
+    if "*" in client_tags or stored.etag in client_tags:
+        return Response(status_code=304, headers=headers)
+    
+    return FileResponse(
+        stored.path,
+        media_type=stored.media_type,
+        headers={**headers, "Content-Disposition": content_disposition(stored.filename)}
+    )
+
 @app.get("/analytics")
 async def get_analytics():
     """
     Get anonymized processing analytics
     (In production, this should be admin-only)
     """
-    if not analytics_log:
-        return {"total_processed": 0, "recent": []}
-    
+    summary = await asyncio.to_thread(analytics.summary, 10)  # Last 10 entries
+    job_counts = await asyncio.to_thread(job_store.counts)
     return {
-        "total_processed": len(analytics_log),
-        "recent": analytics_log[-10:],  # Last 10 entries
-        "avg_processing_time_ms": round(
-            sum(log["processing_time_ms"] for log in analytics_log) / len(analytics_log), 2
-        ),
-        "protection_levels": {
-            "HIGH": sum(1 for log in analytics_log if log["protection_level"] == "HIGH"),
-            "MEDIUM": sum(1 for log in analytics_log if log["protection_level"] == "MEDIUM"),
-            "LOW": sum(1 for log in analytics_log if log["protection_level"] == "LOW"),
-        }
+        **summary,
+        "shape_cache": shape_cache.stats(),
+        "decision_cache": decision_cache.stats(),
+        "result_cache": result_cache.stats() if result_cache is not None else None,
+        "jobs": job_counts,
+        "output_store": output_store.stats() if output_store is not None else None,
+        "worker_pool": protection_pool.stats()
     }
 
-# Cleanup old files on startup
-@app.on_event("startup")
-async def startup_event():
-    """Cleanup temp directory on startup"""
-    logger.info("Starting Consentra Image Protection API")
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Processing counters and per-stage latency histograms in Prometheus text format
+    """
+    snapshot = await asyncio.to_thread(analytics.snapshot)
+    return PlainTextResponse(prometheus_text(snapshot, protection_pool.stats()), media_type="text/plain; version=0.0.4")
+
+def cleanup_temp_dir():
+    """Remove loose files left in the temp directory by earlier runs"""
     for filename in os.listdir(UPLOAD_DIR):
         filepath = os.path.join(UPLOAD_DIR, filename)
         try:
@@ -242,7 +751,27 @@ async def startup_event():
         except Exception as e:
             logger.warning(f"Could not remove {filepath}: {e}")
 
+# Cleanup old files on startup
+@app.on_event("startup")
+async def startup_event():
+    """Start background services; temp cleanup runs off the boot path"""
+    logger.info("Starting Consentra Image Protection API")
+    app.state.cleanup_task = asyncio.create_task(asyncio.to_thread(cleanup_temp_dir))
+    
+    job_scheduler.start()
+    if output_sweeper is not None:
+        output_sweeper.start()
+    
+    # Under serve.py the parent has already warmed the pipeline before forking;
+    # the pool's threads are created here, so they are always warmed
+    app.state.warmup_task = asyncio.create_task(prepare_service(protection_pool))
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("Shutting down Consentra Image Protection API")
+    await job_scheduler.stop()
+    if output_sweeper is not None:
+        await output_sweeper.stop()
+    job_store.close()
+    protection_pool.shutdown()
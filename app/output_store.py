@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+class StoredOutput(NamedTuple):
+    """A protected image kept for re-download"""
+    path: str
+    size: int
+    media_type: str
+    etag: str
+    filename: str
+    created: float
+
+def normalize_image_id(image_id: str) -> Optional[str]:
+    """Canonical form of an image id, or None if it is not a UUID (never a path)"""
+    try:
+        return str(uuid.UUID(image_id))
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+class OutputStore:
+    """
+    Protected images on disk, keyed by image id, with TTL and byte budgets
+    Files are sharded as <dir>/ab/cd/<id>.img plus a <id>.json sidecar so no
+    directory grows large. An in-memory index (age order) enforces the byte
+    budget on every put; the index is rebuilt from disk by sweep(), which
+    runs in the background rather than at startup
+    """
+    
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._index: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+    
+    def _path(self, image_id: str, ext: str) -> str:
+        return os.path.join(self.directory, image_id[:2], image_id[2:4], f"{image_id}.{ext}")
+    
+    def put(self, image_id: str, data: bytes, media_type: str, filename: str, protection_level: str) -> bool:
+        """Store an output; returns False if it can never fit the byte budget"""
+        size = len(data)
+        if size > self.max_bytes:
+            return False
+        
+        data_path, info_path = self._path(image_id, "img"), self._path(image_id, "json")
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        created = time.time()
+        info = {
+            "media_type": media_type,
+            "filename": filename,
+            "protection_level": protection_level,
+            "size": size,
+            "created": created,
+            "etag": f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+        }
+        # Sidecar last, so a readable sidecar always has its image in place
+        with open(data_path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(data_path + ".tmp", data_path)
+        with open(info_path + ".tmp", "w") as f:
+            json.dump(info, f)
+        os.replace(info_path + ".tmp", info_path)
+        
+        with self._lock:
+            if image_id in self._index:
+                self._bytes -= self._index.pop(image_id)[1]
+            self._index[image_id] = (created, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._index)))
+        return True
+    
+    def get(self, image_id: str) -> Optional[StoredOutput]:
+        """Look up an unexpired output; None if unknown, expired or not a valid id"""
+        image_id = normalize_image_id(image_id)
+        if image_id is None:
+            return None
+        
+        try:
+            with open(self._path(image_id, "json")) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if time.time() - info["created"] > self.ttl_seconds:
+            with self._lock:
+                self._remove(image_id)
+            return None
+        return StoredOutput(
+            self._path(image_id, "img"), info["size"], info["media_type"],
+            info["etag"], info["filename"], info["created"]
+        )
+    
+    def _remove(self, image_id: str):
+        entry = self._index.pop(image_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        for ext in ("json", "img"):
+            try:
+                os.remove(self._path(image_id, ext))
+            except OSError:
+                pass
+    
+    def sweep(self) -> int:
+        """
+        Delete expired outputs and stale temp files, rebuild the index from
+        disk and evict the oldest outputs over the byte budget
+        Returns the number of outputs removed
+        """
+        now = time.time()
+        found = []
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                image_id, ext = os.path.splitext(name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                expired = now - stat.st_mtime > self.ttl_seconds
+                if ext == ".img":
+                    if expired:
+                        with self._lock:
+                            self._remove(image_id)
+                        removed += 1
+                    else:
+                        found.append((stat.st_mtime, image_id, stat.st_size))
+                elif expired and (ext == ".tmp" or not os.path.exists(os.path.join(root, f"{image_id}.img"))):
+                    # Interrupted writes and sidecars whose image is gone
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        
+        with self._lock:
+            index = OrderedDict((image_id, (created, size)) for created, image_id, size in sorted(found))
+            # Outputs stored while the directory was being walked
+            for image_id, entry in self._index.items():
+                index.setdefault(image_id, entry)
+            self._index = OrderedDict(sorted(index.items(), key=lambda item: item[1][0]))
+            self._bytes = sum(size for _, size in self._index.values())
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._index)))
+                removed += 1
+        return removed
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+class OutputSweeper:
+    """
+    Background loop running OutputStore.sweep every `interval` seconds
+    The first sweep runs right away, off the event loop, so a large store
+    never delays startup
+    """
+    
+    def __init__(self, store: OutputStore, interval: float = 60.0):
+        self.store = store
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.store.sweep)
+                if removed:
+                    logger.info(f"Removed {removed} protected images (expired or over budget)")
+            except Exception as e:
+                logger.warning(f"Output store sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+def create_output_store(backend: str, directory: str, max_bytes: int, ttl_seconds: float) -> Optional[OutputStore]:
+    """
+    Build the output store for the configured backend ("disk" or "none")
+    """
+    if backend == "disk":
+        return OutputStore(directory, max_bytes, ttl_seconds)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown output store backend: {backend}")
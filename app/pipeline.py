@@ -0,0 +1,75 @@
+import os
+from typing import Dict, Optional, Tuple
+
+from app.agent import decide_protection_level
+from app.image_protect import decode_image, protect_image
+from app.timing import collect_timings
+from app.watermark import DEFAULT_ENCODE_OPTIONS, EncodeOptions, encode_image, verify_watermark, watermark_image
+
+# Images above TILE_THRESHOLD_MP megapixels are protected tile by tile
+TILE_THRESHOLD_MP = float(os.getenv("TILE_THRESHOLD_MP", "24"))
+TILE_SIZE = int(os.getenv("TILE_SIZE", "1024"))
+TILE_WORKERS = int(os.getenv("TILE_WORKERS", "1"))
+
+class ImageDecodeError(ValueError):
+    """Raised when uploaded bytes cannot be decoded as an image"""
+
+def run_protection(
+    data: bytes,
+    filename: Optional[str],
+    owner_id: str,
+    seed: Optional[int] = None,
+    image_info: Optional[Dict] = None,
+    encode_options: Optional[EncodeOptions] = None
+) -> Tuple[str, bytes, Dict]:
+    """
+    Full CPU-bound protection pipeline for one upload
+    Decode -> agent decision -> protection -> watermark -> lossless encode
+    Kept as a plain module-level function so it can run in a thread or process pool
+    An optional seed makes the protection noise reproducible; image_info is the
+    header probe result, if the caller already has one; encode_options picks
+    the output format (server defaults when omitted)
+    Per-stage durations are returned in metadata["stage_timings_ms"]
+    Returns: (protection_level, image_bytes, metadata)
+    """
+    with collect_timings() as timings:
+        # Decode once and pass the same array through the whole pipeline
+        image = decode_image(data)
+        if image is None:
+            raise ImageDecodeError("Could not decode image")
+        
+        # Agentic decision making
+        protection_level, agent_metadata = decide_protection_level(image, filename or "", image_info)
+        
+        # Apply AI protection, tiled for very large images to bound memory
+        h, w = image.shape[:2]
+        tile_size = TILE_SIZE if h * w > TILE_THRESHOLD_MP * 1_000_000 else None
+        protected_img, protection_metadata = protect_image(
+            image, protection_level, seed=seed, tile_size=tile_size, tile_workers=TILE_WORKERS
+        )
+        del image  # Release the decoded upload before encoding
+        
+        # Add watermark with user/owner ID (the protected array is ours, so embed in place)
+        watermarked = watermark_image(protected_img, owner_id, consent=True, copy=False)
+        
+        encode_options = encode_options or DEFAULT_ENCODE_OPTIONS
+        image_bytes = encode_image(watermarked, encode_options)
+    
+    stage_timings = {name: round(duration, 2) for name, duration in timings.items()}
+    encode_metadata = {
+        "output_format": encode_options.format,
+        "png_compression": encode_options.png_compression if encode_options.format == "png" else None,
+        "png_fast_filters": encode_options.png_fast_filters if encode_options.format == "png" else None,
+        "encode_time_ms": stage_timings["encode"],
+        "output_bytes": len(image_bytes)
+    }
+    
+    return protection_level, image_bytes, {
+        **agent_metadata, **protection_metadata, **encode_metadata, "stage_timings_ms": stage_timings
+    }
+
+def run_verification(data: bytes) -> Optional[Dict]:
+    """
+    Decode an upload and extract its watermark metadata, if any
+    """
+    return verify_watermark(decode_image(data))
@@ -0,0 +1,98 @@
+import struct
+from typing import Dict, Optional
+
+# PNG color type -> channel count (palette images decode to 3 channels)
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+
+# JPEG start-of-frame markers (everything in C0-CF except DHT, JPG and DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def _image_info(fmt: str, width: int, height: int, channels: int) -> Optional[Dict]:
+    if width <= 0 or height <= 0:
+        return None
+    return {"format": fmt, "width": width, "height": height, "channels": channels}
+
+def _probe_png(data: bytes) -> Optional[Dict]:
+    # Signature, then IHDR must be the first chunk
+    if len(data) < 26 or data[12:16] != b"IHDR":
+        return None
+    width, height, _bit_depth, color_type = struct.unpack(">IIBB", data[16:26])
+    return _image_info("png", width, height, PNG_CHANNELS.get(color_type, 3))
+
+def _probe_jpeg(data: bytes) -> Optional[Dict]:
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        
+        # Fill bytes and standalone markers carry no length field
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            offset += 2
+            continue
+        # Start of scan before any frame header: not a valid image
+        if marker in (0xD9, 0xDA):
+            return None
+        
+        (segment_length,) = struct.unpack(">H", data[offset + 2:offset + 4])
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 10 > len(data):
+                return None
+            height, width, components = struct.unpack(">HHB", data[offset + 5:offset + 10])
+            return _image_info("jpeg", width, height, components)
+        offset += 2 + segment_length
+    
+    return None
+
+def _probe_webp(data: bytes) -> Optional[Dict]:
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    
+    if chunk == b"VP8 ":
+        # Lossy: frame tag (3 bytes), start code, then 14-bit dimensions
+        if data[23:26] != b"\x9d\x01\x2a":
+            return None
+        width, height = struct.unpack("<HH", data[26:30])
+        return _image_info("webp", width & 0x3FFF, height & 0x3FFF, 3)
+    
+    if chunk == b"VP8L":
+        # Lossless: signature byte, then width-1 and height-1 packed in 14 bits each
+        if data[20] != 0x2F:
+            return None
+        (bits,) = struct.unpack("<I", data[21:25])
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+        has_alpha = (bits >> 28) & 1
+        return _image_info("webp", width, height, 4 if has_alpha else 3)
+    
+    if chunk == b"VP8X":
+        # Extended: flags, then 24-bit canvas width-1 and height-1
+        has_alpha = data[20] & 0x10
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return _image_info("webp", width, height, 4 if has_alpha else 3)
+    
+    return None
+
+def probe_image(data: bytes) -> Optional[Dict]:
+    """
+    Read format, dimensions and channel count from PNG/JPEG/WebP headers
+    Never decodes pixel data, so it is safe to run on untrusted uploads
+    before deciding whether to decode them at all
+    Returns None for unsupported or malformed headers
+    """
+    try:
+        if data.startswith(b"\x89PNG\r\n\x1a\n"):
+            return _probe_png(data)
+        if data.startswith(b"\xff\xd8"):
+            return _probe_jpeg(data)
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return _probe_webp(data)
+    except struct.error:
+        return None
+    
+    return None
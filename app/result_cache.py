@@ -0,0 +1,295 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+class CachedResult(NamedTuple):
+    """A previously protected image and what the pipeline reported for it"""
+    protection_level: str
+    png_bytes: bytes
+    metadata: Dict
+
+def result_cache_key(
+    data: bytes,
+    risk_class: str,
+    owner_id: str,
+    seed: Optional[int] = None,
+    output: str = ""
+) -> str:
+    """
+    Content address for a protection result
+    The protection level is a function of image content and the filename risk
+    class, so hashing the bytes plus that class pins the level; owner_id and
+    seed pin the watermark and noise, and output the encoding
+    """
+    digest = hashlib.sha256(data)
+    digest.update(f"|{risk_class}|{owner_id}|{seed}|{output}".encode("utf-8"))
+    return digest.hexdigest()
+
+class MemoryCacheBackend:
+    """
+    In-process LRU with a byte budget and TTL
+    """
+    
+    def __init__(self, max_bytes: int, ttl_seconds: float):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, result = entry
+            if time.time() - created > self.ttl_seconds:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return result
+    
+    def set(self, key: str, result: CachedResult):
+        size = len(result.png_bytes)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time(), result)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+    
+    def _remove(self, key: str):
+        _, result = self._entries.pop(key)
+        self._bytes -= len(result.png_bytes)
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+class DiskCacheBackend:
+    """
+    Local on-disk store: <key>.png plus a <key>.json sidecar, shareable by
+    several worker processes pointed at the same directory
+    The sidecar's mtime is the entry's age (for TTL) and the image's mtime its
+    last use (touched on every hit), so recency survives across processes. An
+    in-memory index saves stats on lookups; entries it doesn't know are looked
+    up on disk, and the byte budget is enforced by scanning the directory so it
+    counts every process's entries
+    """
+    
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._index: Dict[str, tuple] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._enforce_budget()
+    
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+    
+    def _stat_entry(self, key: str) -> Optional[tuple]:
+        """(created, last_used, size) from disk; None if either file is missing"""
+        try:
+            created = os.stat(self._path(key, "json")).st_mtime
+            stat = os.stat(self._path(key, "png"))
+        except OSError:
+            return None
+        return created, stat.st_mtime, stat.st_size
+    
+    def _enforce_budget(self):
+        """
+        Rebuild the index from the directory, dropping expired entries and the
+        least recently used ones until the budget holds
+        """
+        now = time.time()
+        entries = []
+        with os.scandir(self.directory) as it:
+            for item in it:
+                key, ext = os.path.splitext(item.name)
+                entry = self._stat_entry(key) if ext == ".png" else None
+                if entry is None:
+                    # Interrupted writes, and halves of entries whose other
+                    # file was evicted while being rewritten
+                    if ext == ".tmp" or not os.path.exists(self._path(key, "json" if ext == ".png" else "png")):
+                        try:
+                            if now - item.stat().st_mtime > self.ttl_seconds:
+                                os.remove(item.path)
+                        except OSError:
+                            pass
+                    continue
+                if now - entry[0] > self.ttl_seconds:
+                    self._delete_files(key)
+                else:
+                    entries.append((entry[1], key, entry))
+        
+        total = sum(entry[2] for _, _, entry in entries)
+        index = {}
+        # Least recently used first
+        for _, key, entry in sorted(entries):
+            if total > self.max_bytes:
+                self._delete_files(key)
+                total -= entry[2]
+            else:
+                index[key] = (entry[0], entry[2])
+        
+        with self._lock:
+            self._index = index
+            self._bytes = total
+    
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._index.get(key)
+        if entry is None:
+            # Possibly stored by another worker process
+            found = self._stat_entry(key)
+            if found is None:
+                return None
+            entry = (found[0], found[2])
+            with self._lock:
+                if key not in self._index:
+                    self._index[key] = entry
+                    self._bytes += entry[1]
+        
+        if time.time() - entry[0] > self.ttl_seconds:
+            with self._lock:
+                self._remove(key)
+            return None
+        
+        try:
+            with open(self._path(key, "json")) as f:
+                info = json.load(f)
+            with open(self._path(key, "png"), "rb") as f:
+                png_bytes = f.read()
+        except (OSError, ValueError):
+            # Evicted by another worker since it was indexed
+            with self._lock:
+                self._forget(key)
+            return None
+        
+        try:
+            os.utime(self._path(key, "png"))
+        except OSError:
+            pass
+        return CachedResult(info["protection_level"], png_bytes, info["metadata"])
+    
+    def set(self, key: str, result: CachedResult):
+        size = len(result.png_bytes)
+        if size > self.max_bytes:
+            return
+        
+        # Write to unique temp files and rename so readers never see partial
+        # files and concurrent sets of the same key don't collide
+        png_path, json_path = self._path(key, "png"), self._path(key, "json")
+        png_tmp = self._write_temp(result.png_bytes)
+        json_tmp = self._write_temp(json.dumps(
+            {"protection_level": result.protection_level, "metadata": result.metadata}, default=str
+        ).encode("utf-8"))
+        try:
+            os.replace(png_tmp, png_path)
+            os.replace(json_tmp, json_path)
+        except OSError:
+            for path in (png_tmp, json_tmp):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        
+        with self._lock:
+            self._forget(key)
+            self._index[key] = (time.time(), size)
+            self._bytes += size
+        self._enforce_budget()
+    
+    def _write_temp(self, data: bytes) -> str:
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+    
+    def _forget(self, key: str):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+    
+    def _delete_files(self, key: str):
+        for ext in ("png", "json"):
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+    
+    def _remove(self, key: str):
+        self._forget(key)
+        self._delete_files(key)
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"backend": "disk", "entries": len(self._index), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+class ResultCache:
+    """
+    Content-addressed cache of protected images in front of the pipeline
+    Wraps a storage backend and keeps hit/miss counters for analytics
+    """
+    
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[CachedResult]:
+        result = self.backend.get(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+    
+    def set(self, key: str, result: CachedResult):
+        """Store a result; a failed write only costs a future cache miss"""
+        try:
+            self.backend.set(key, result)
+        except OSError as e:
+            logger.warning(f"Could not cache result {key[:12]}: {e}")
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            hits, misses = self.hits, self.misses
+        return {
+            **self.backend.stats(),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+def create_result_cache(backend: str, max_bytes: int, ttl_seconds: float, directory: str) -> Optional[ResultCache]:
+    """
+    Build a ResultCache for the configured backend ("memory", "disk" or "none")
+    """
+    if backend == "memory":
+        return ResultCache(MemoryCacheBackend(max_bytes, ttl_seconds))
+    if backend == "disk":
+        return ResultCache(DiskCacheBackend(directory, max_bytes, ttl_seconds))
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown result cache backend: {backend}")
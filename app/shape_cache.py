@@ -0,0 +1,78 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+class ShapeCache:
+    """
+    LRU cache for arrays that depend only on image dimensions
+    (frequency masks, robustness textures, ...)
+    Entries are keyed on (name, h, w, dtype), bounded by a total byte budget and
+    returned read-only so they can be shared safely between worker threads.
+    """
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, name: str, h: int, w: int, dtype, builder: Callable[[int, int, np.dtype], np.ndarray]) -> np.ndarray:
+        """
+        Return the cached array for (name, h, w, dtype), building it on a miss
+        """
+        dtype = np.dtype(dtype)
+        key = (name, h, w, dtype.str)
+        
+        with self._lock:
+            array = self._entries.get(key)
+            if array is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return array
+            self.misses += 1
+        
+        # Build outside the lock; a concurrent miss on the same key just wastes work
+        array = np.ascontiguousarray(builder(h, w, dtype), dtype=dtype)
+        array.flags.writeable = False
+        
+        if array.nbytes > self.max_bytes:
+            return array
+        
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = array
+                self._bytes += array.nbytes
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+                    self.evictions += 1
+            return self._entries.get(key, array)
+    
+    def stats(self) -> Dict:
+        """Hit/miss counters and current memory use"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+    
+    def clear(self):
+        """Drop all entries (counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+# Shared by all protection stages in this process
+shape_cache = ShapeCache(int(os.getenv("SHAPE_CACHE_MB", "256")) * 1024 * 1024)
@@ -0,0 +1,58 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Optional
+
+# Stage durations (ms) for the pipeline run in the current context, if collecting
+_current_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+# Spans from worker threads (run in a copied context) add into the same dict
+_timings_lock = threading.Lock()
+
+@contextmanager
+def collect_timings():
+    """
+    Collect span durations for everything run inside the block
+    Yields the dict that spans accumulate into (stage name -> ms)
+    """
+    timings = {}
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+@contextmanager
+def span(name: str):
+    """
+    Time a block as stage `name`; repeated and concurrent stages add up
+    Costs one context variable lookup when nothing is collecting
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        with _timings_lock:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+def timed(name: str):
+    """Decorator form of span() for whole functions"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Format stage durations as a Server-Timing header value"""
+    return ", ".join(f"{name};dur={duration:.2f}" for name, duration in timings.items())
@@ -0,0 +1,84 @@
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+# Allowance for multipart boundaries, part headers and small form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Chunk size used when copying an upload into memory
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+def request_too_large(limit: int) -> HTTPException:
+    """413 used when a request body exceeds its limit"""
+    return HTTPException(
+        status_code=413,
+        detail=f"Request body too large. Max size: {limit // (1024 * 1024)}MB"
+    )
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware capping request body size before it is parsed
+    Requests with a Content-Length over the limit are rejected without reading
+    the body; otherwise the body is counted as it streams in (covering chunked
+    uploads and lying headers) and the request fails with 413 as soon as it
+    goes over, instead of after multipart parsing has spooled all of it
+    """
+    
+    def __init__(self, app, max_body_bytes: int, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.path_limits = path_limits or {}
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+        
+        limit = self.path_limits.get(scope["path"], self.max_body_bytes)
+        
+        # Cheap pre-check from the declared length
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > limit:
+                    error = request_too_large(limit)
+                    response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+                    await response(scope, receive, send)
+                    return
+                break
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI re-raises HTTPExceptions from body parsing as-is
+                    raise request_too_large(limit)
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+async def read_upload(file, max_bytes: int) -> bytes:
+    """
+    Copy an upload into memory in chunks, stopping as soon as it exceeds max_bytes
+    Raises 413, like UploadSizeLimitMiddleware, when the file is too large
+    """
+    buffer = bytearray()
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large. Max size: {max_bytes // (1024 * 1024)}MB"
+            )
+    return bytes(buffer)
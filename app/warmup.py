@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.agent import FACE_DETECT_MAX_SIDE, detect_faces, downscale_image
+from app.image_protect import protect_image
+from app.watermark import encode_image, verify_watermark, watermark_image
+
+logger = logging.getLogger(__name__)
+
+# Representative upload shapes (WIDTHxHEIGHT) warmed before serving; empty disables warm-up
+WARMUP_SHAPES = os.getenv("WARMUP_SHAPES", "1024x768,1920x1080")
+
+# Readiness state; the pipeline part is shared copy-on-write with forked
+# workers when warmed in the parent, pool workers are warmed in each process
+warmup_state = {
+    "ready": False,
+    "pipeline_warmed": False,
+    "pool_workers_warmed": 0,
+    "started": None,
+    "duration_ms": None,
+    "shapes": [],
+    "error": None
+}
+_warmup_lock = threading.Lock()
+
+def parse_shapes(spec: str) -> List[Tuple[int, int]]:
+    """Parse "1024x768,1920x1080" into [(width, height)]"""
+    shapes = []
+    for part in spec.split(","):
+        if part.strip():
+            width, height = part.lower().split("x")
+            shapes.append((int(width), int(height)))
+    return shapes
+
+def _warmup_image(width: int, height: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    coarse = rng.integers(0, 256, (height // 64 + 2, width // 64 + 2, 3), dtype=np.uint8)
+    return cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+
+def warm_up(shapes: Optional[List[Tuple[int, int]]] = None) -> Dict:
+    """
+    Run every pipeline stage once per representative shape
+    Loads the face cascade's working state, FFT paths, per-shape masks and
+    textures in the shape cache, and the allocator's large-buffer pools, so
+    the first real requests don't pay cold-start costs
+    The decision cache is bypassed so synthetic images never answer for real ones
+    Idempotent; returns the readiness state
+    """
+    with _warmup_lock:
+        if warmup_state["pipeline_warmed"]:
+            return warmup_state
+        
+        shapes = parse_shapes(WARMUP_SHAPES) if shapes is None else shapes
+        warmup_state["started"] = time.time()
+        start = time.perf_counter()
+        try:
+            for width, height in shapes:
+                image = _warmup_image(width, height)
+                detect_faces(cv2.cvtColor(downscale_image(image, FACE_DETECT_MAX_SIDE), cv2.COLOR_BGR2GRAY))
+                # HIGH exercises every stage (noise, gradient and texture)
+                protected, _ = protect_image(image, "HIGH", seed=0)
+                marked = watermark_image(protected, "warmup", copy=False)
+                verify_watermark(marked)
+                encode_image(marked)
+                warmup_state["shapes"].append(f"{width}x{height}")
+        except Exception as e:
+            # A failed warm-up only costs latency, so still go on to serve
+            logger.warning(f"Warm-up failed: {e}", exc_info=True)
+            warmup_state["error"] = str(e)
+        
+        warmup_state["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        warmup_state["pipeline_warmed"] = True
+        logger.info(f"Warm-up finished in {warmup_state['duration_ms']}ms for shapes {warmup_state['shapes']}")
+        return warmup_state
+
+def warm_worker(shapes: Optional[List[Tuple[int, int]]] = None):
+    """
+    Per-thread warm-up for a pool worker: builds the thread's own face
+    cascade and runs detection once per shape
+    """
+    shapes = parse_shapes(WARMUP_SHAPES) if shapes is None else shapes
+    for width, height in shapes:
+        detect_faces(cv2.cvtColor(downscale_image(_warmup_image(width, height), FACE_DETECT_MAX_SIDE), cv2.COLOR_BGR2GRAY))
+
+async def prepare_service(pool) -> Dict:
+    """
+    Warm the pipeline (a no-op if serve.py already did before forking), then
+    every worker of the protection pool, and mark the service ready
+    """
+    await asyncio.to_thread(warm_up)
+    try:
+        warmup_state["pool_workers_warmed"] = await pool.run_on_each_worker(warm_worker)
+    except Exception as e:
+        # As with warm_up, a failure only costs latency
+        logger.warning(f"Worker warm-up failed: {e}", exc_info=True)
+        warmup_state["error"] = warmup_state["error"] or str(e)
+    warmup_state["ready"] = True
+    return warmup_state
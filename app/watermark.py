@@ -1,36 +1,189 @@
 import cv2
 import numpy as np
+import hashlib
 import json
+import os
+import struct
+import time
+import uuid
+import zlib
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from app.timing import timed
+
+# Lossless output formats -> (media type, file extension)
+# The LSB watermark only survives encoders that round-trip pixels exactly
+OUTPUT_FORMATS = {"png": ("image/png", ".png"), "webp": ("image/webp", ".webp")}
+
+# Requested formats that are refused because lossy coding wipes the LSB plane
+LOSSY_FORMATS = {"jpeg", "jpg", "webp-lossy", "avif", "heic"}
+
+# Largest width/height a WebP image can have
+WEBP_MAX_DIMENSION = 16383
+
+class EncodeOptions(NamedTuple):
+    """How a protected image is encoded (always lossless)"""
+    format: str = "png"
+    png_compression: int = 3
+    png_fast_filters: bool = False
+
+def make_encode_options(
+    fmt: Optional[str] = None,
+    png_compression: Optional[int] = None,
+    png_fast_filters: Optional[bool] = None,
+    defaults: Optional[EncodeOptions] = None
+) -> EncodeOptions:
+    """
+    Build validated encode options, filling unset values from `defaults`
+    Raises ValueError for unknown formats, lossy formats and bad PNG levels
+    """
+    defaults = defaults or EncodeOptions()
+    fmt = (fmt or defaults.format).lower()
+    if fmt in LOSSY_FORMATS:
+        raise ValueError(f"Output format '{fmt}' is lossy and would destroy the watermark. Use png or webp")
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format '{fmt}'. Use png or webp")
+    
+    png_compression = defaults.png_compression if png_compression is None else png_compression
+    if not 0 <= png_compression <= 9:
+        raise ValueError("PNG compression level must be between 0 and 9")
+    
+    png_fast_filters = defaults.png_fast_filters if png_fast_filters is None else png_fast_filters
+    return EncodeOptions(fmt, png_compression, bool(png_fast_filters))
+
+# Server-wide defaults, overridable per request
+DEFAULT_ENCODE_OPTIONS = make_encode_options(
+    os.getenv("OUTPUT_FORMAT", "png"),
+    int(os.getenv("PNG_COMPRESSION", "3")),
+    os.getenv("PNG_FAST_FILTERS", "false").lower() in ("1", "true", "yes")
+)
+
+def check_encode_dimensions(options: EncodeOptions, width: int, height: int):
+    """Raise ValueError if an image of this size can't be written in the chosen format"""
+    if options.format == "webp" and max(width, height) > WEBP_MAX_DIMENSION:
+        raise ValueError(f"WebP output is limited to {WEBP_MAX_DIMENSION} pixels per side. Use png")
+
+@timed("encode")
+def encode_image(image: np.ndarray, options: Optional[EncodeOptions] = None) -> bytes:
+    """
+    Losslessly encode a watermarked image
+    Lower PNG levels and fast filters trade a few percent of size for much
+    faster encodes; protection noise leaves little for zlib to find anyway
+    """
+    options = options or DEFAULT_ENCODE_OPTIONS
+    if options.format == "webp":
+        # Quality above 100 selects libwebp's lossless mode
+        params = [cv2.IMWRITE_WEBP_QUALITY, 101]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, options.png_compression]
+        if options.png_fast_filters:
+            params += [cv2.IMWRITE_PNG_FILTER, cv2.IMWRITE_PNG_FAST_FILTERS]
+    
+    success, encoded = cv2.imencode(OUTPUT_FORMATS[options.format][1], image, params)
+    if not success:
+        raise ValueError("Could not encode watermarked image")
+    return encoded.tobytes()
 
 def text_to_bits(text: str) -> list:
     """Convert text to binary bits"""
-    bits = []
-    for char in text:
-        bits.extend([int(b) for b in format(ord(char), '08b')])
-    return bits
+    return np.unpackbits(np.frombuffer(text.encode("latin-1"), dtype=np.uint8)).tolist()
 
 def bits_to_text(bits: list) -> str:
     """Convert binary bits to text"""
-    chars = []
-    for i in range(0, len(bits), 8):
-        byte = bits[i:i+8]
-        if len(byte) == 8:
-            chars.append(chr(int(''.join([str(b) for b in byte]), 2)))
-    return ''.join(chars)
+    usable = len(bits) - len(bits) % 8
+    return np.packbits(np.asarray(bits[:usable], dtype=np.uint8)).tobytes().decode("latin-1")
+
+# Binary watermark payload (version 2):
+#   magic (2) | version (1) | flags (1) | epoch seconds (4) | owner length (1) | owner | CRC32 (4)
+# flags bit 0 is consent, bits 1-2 say how the owner id is stored
+PAYLOAD_MAGIC = b"\xc5W"
+PAYLOAD_VERSION = 2
+PAYLOAD_HEADER = struct.Struct(">2sBBIB")
+PAYLOAD_CRC = struct.Struct(">I")
 
-def embed_watermark_lsb(image: np.ndarray, watermark_data: str) -> np.ndarray:
+OWNER_UTF8 = 0     # Owner id stored as-is
+OWNER_UUID = 1     # Canonical UUID string stored as its 16 raw bytes
+OWNER_SHA256 = 2   # Long owner id stored as a 16-byte SHA-256 prefix
+
+# Longest owner id (UTF-8 bytes) embedded verbatim; longer ones are hashed
+MAX_OWNER_BYTES = 32
+
+def _encode_owner(owner_id: str) -> Tuple[int, bytes]:
+    try:
+        parsed = uuid.UUID(owner_id)
+        if str(parsed) == owner_id:
+            return OWNER_UUID, parsed.bytes
+    except ValueError:
+        pass
+    
+    raw = owner_id.encode("utf-8")
+    if len(raw) <= MAX_OWNER_BYTES:
+        return OWNER_UTF8, raw
+    return OWNER_SHA256, hashlib.sha256(raw).digest()[:16]
+
+def pack_watermark_payload(owner_id: str, consent: bool = True, timestamp: Optional[int] = None) -> bytes:
     """
-    Embed watermark using LSB steganography
-    Distributes data across image to survive cropping
+    Build the compact binary watermark payload for an owner
+    About 20-30 bytes, versus well over 100 for the legacy JSON metadata
     """
-    # Add length prefix and delimiter
-    watermark_with_length = f"{len(watermark_data)}|{watermark_data}"
-    bits = text_to_bits(watermark_with_length)
+    owner_kind, owner = _encode_owner(owner_id)
+    if timestamp is None:
+        timestamp = int(time.time())
+    flags = int(bool(consent)) | (owner_kind << 1)
+    body = PAYLOAD_HEADER.pack(PAYLOAD_MAGIC, PAYLOAD_VERSION, flags, timestamp, len(owner)) + owner
+    return body + PAYLOAD_CRC.pack(zlib.crc32(body))
+
+def unpack_watermark_payload(payload: bytes) -> Optional[Dict]:
+    """
+    Decode a binary watermark payload into watermark metadata
+    Returns None if the magic, version, length or CRC don't check out
+    """
+    if len(payload) < PAYLOAD_HEADER.size + PAYLOAD_CRC.size:
+        return None
+    magic, version, flags, timestamp, owner_length = PAYLOAD_HEADER.unpack_from(payload)
+    if magic != PAYLOAD_MAGIC or version != PAYLOAD_VERSION:
+        return None
+    
+    body_length = PAYLOAD_HEADER.size + owner_length
+    if len(payload) < body_length + PAYLOAD_CRC.size:
+        return None
+    (crc,) = PAYLOAD_CRC.unpack_from(payload, body_length)
+    if crc != zlib.crc32(payload[:body_length]):
+        return None
     
-    # Add terminator
-    bits.extend([0] * 16)  # Null terminator
+    owner = payload[PAYLOAD_HEADER.size:body_length]
+    owner_kind = (flags >> 1) & 0b11
+    metadata = {
+        "owner_id": None,
+        "consent": bool(flags & 1),
+        "timestamp": datetime.utcfromtimestamp(timestamp).isoformat(),
+        "version": f"{version}.0"
+    }
+    if owner_kind == OWNER_UTF8:
+        metadata["owner_id"] = owner.decode("utf-8", errors="replace")
+    elif owner_kind == OWNER_UUID and len(owner) == 16:
+        metadata["owner_id"] = str(uuid.UUID(bytes=owner))
+    else:
+        metadata["owner_id_sha256"] = owner.hex()
+    return metadata
+
+def _lsb_bytes(flat: np.ndarray, start: int, count: int) -> bytes:
+    """
+    Pack the LSBs of a flat image view back into bytes
+    Reads `count` bytes starting at byte offset `start`
+    """
+    bits = flat[start * 8:(start + count) * 8] & 1
+    return np.packbits(bits).tobytes()
+
+@timed("watermark_embed")
+def embed_payload_lsb(image: np.ndarray, payload: bytes, copy: bool = True) -> np.ndarray:
+    """
+    Write raw payload bytes into the image LSBs, starting at the first pixel
+    copy=False writes into `image` itself (when C-contiguous) instead of
+    allocating a full-size copy
+    """
+    bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
     
     h, w, c = image.shape
     max_bits = h * w * c
@@ -38,55 +191,84 @@ def embed_watermark_lsb(image: np.ndarray, watermark_data: str) -> np.ndarray:
     if len(bits) > max_bits:
         raise ValueError("Watermark too large for image")
     
-    watermarked = image.copy()
-    bit_index = 0
-    
-    # Embed across all channels in a distributed pattern
-    for i in range(h):
-        for j in range(w):
-            for k in range(c):
-                if bit_index < len(bits):
-                    # Modify LSB
-                    watermarked[i, j, k] = (image[i, j, k] & 0xFE) | bits[bit_index]
-                    bit_index += 1
-                else:
-                    break
-            if bit_index >= len(bits):
-                break
-        if bit_index >= len(bits):
-            break
+    # Bits are laid out in row-major (h, w, c) order, so a flat view of a
+    # C-contiguous copy touches exactly the elements the format expects
+    if copy or not image.flags.c_contiguous:
+        watermarked = image.copy(order="C")
+    else:
+        watermarked = image
+    flat = watermarked.reshape(-1)
+    n = len(bits)
+    flat[:n] = (flat[:n] & 0xFE) | bits
     
     return watermarked
 
+def embed_watermark_lsb(image: np.ndarray, watermark_data: str, copy: bool = True) -> np.ndarray:
+    """
+    Embed a legacy text watermark using LSB steganography
+    Format: "<length>|<data>" as latin-1 plus a 16-bit null terminator
+    copy=False writes into `image` itself (when C-contiguous)
+    """
+    watermark_with_length = f"{len(watermark_data)}|{watermark_data}"
+    return embed_payload_lsb(image, watermark_with_length.encode("latin-1") + b"\x00\x00", copy=copy)
+
+def extract_payload_lsb(image: np.ndarray) -> Optional[Dict]:
+    """
+    Read and decode a binary (version 2) watermark payload
+    Reads the fixed header first and then only the bytes it announces
+    Returns None if the image doesn't start with a valid payload
+    """
+    flat = np.ascontiguousarray(image).reshape(-1)
+    capacity = flat.size // 8
+    if capacity < PAYLOAD_HEADER.size + PAYLOAD_CRC.size:
+        return None
+    
+    header = _lsb_bytes(flat, 0, PAYLOAD_HEADER.size)
+    if not header.startswith(PAYLOAD_MAGIC):
+        return None
+    total = PAYLOAD_HEADER.size + header[-1] + PAYLOAD_CRC.size
+    if total > capacity:
+        return None
+    return unpack_watermark_payload(header + _lsb_bytes(flat, PAYLOAD_HEADER.size, total - PAYLOAD_HEADER.size))
+
+# Longest decimal length prefix read before an image is treated as unwatermarked
+MAX_LENGTH_DIGITS = 10
+
 def extract_watermark_lsb(image: np.ndarray) -> Optional[str]:
     """
     Extract watermark from LSB
+    Streams the "<length>|" prefix a byte at a time and then reads exactly
+    `length` bytes, so cost depends on payload size rather than image size
     """
-    h, w, c = image.shape
-    bits = []
+    flat = np.ascontiguousarray(image).reshape(-1)
+    capacity = flat.size // 8
     
-    # Extract bits
-    for i in range(h):
-        for j in range(w):
-            for k in range(c):
-                bits.append(image[i, j, k] & 1)
+    # Read the length prefix, bailing out on the first byte that can't belong to it
+    digits = b""
+    offset = 0
+    while True:
+        if offset >= capacity or len(digits) > MAX_LENGTH_DIGITS:
+            return None
+        byte = _lsb_bytes(flat, offset, 1)
+        offset += 1
+        if byte == b"|":
+            break
+        if not byte.isdigit():
+            return None
+        digits += byte
     
-    # Try to decode
-    try:
-        text = bits_to_text(bits)
-        # Find delimiter
-        if '|' in text:
-            length_str, data = text.split('|', 1)
-            length = int(length_str)
-            return data[:length]
-    except:
-        pass
+    if not digits:
+        return None
     
-    return None
+    length = int(digits)
+    if length > capacity - offset:
+        return None
+    
+    return _lsb_bytes(flat, offset, length).decode("latin-1")
 
 def create_watermark_metadata(owner_id: str, consent: bool = True) -> str:
     """
-    Create watermark metadata JSON
+    Create legacy (version 1.0) watermark metadata JSON
     """
     metadata = {
         "owner_id": owner_id,
@@ -96,29 +278,39 @@ def create_watermark_metadata(owner_id: str, consent: bool = True) -> str:
     }
     return json.dumps(metadata)
 
-def add_watermark(image: np.ndarray, owner_id: str, output_path: str, consent: bool = True) -> str:
+def watermark_image(image: np.ndarray, owner_id: str, consent: bool = True, copy: bool = True) -> np.ndarray:
+    """
+    Embed the owner/consent watermark and return the watermarked array
+    copy=False embeds directly into `image` to avoid a full-size copy
+    """
+    return embed_payload_lsb(image, pack_watermark_payload(owner_id, consent), copy=copy)
+
+def add_watermark(
+    image: np.ndarray,
+    owner_id: str,
+    consent: bool = True,
+    copy: bool = True,
+    options: Optional[EncodeOptions] = None
+) -> bytes:
     """
     Add invisible watermark with owner ID and consent information
+    copy=False embeds directly into `image` to avoid a full-size copy
+    Returns the watermarked image losslessly encoded (PNG unless options say otherwise)
     """
-    # Create metadata
-    watermark_data = create_watermark_metadata(owner_id, consent)
-    
-    # Embed watermark
-    watermarked_image = embed_watermark_lsb(image, watermark_data)
-    
-    # Save with high quality
-    cv2.imwrite(output_path, watermarked_image, [cv2.IMWRITE_PNG_COMPRESSION, 9])
-    
-    return output_path
+    return encode_image(watermark_image(image, owner_id, consent, copy), options)
 
-def verify_watermark(image_path: str) -> Optional[Dict]:
+def verify_watermark(image: np.ndarray) -> Optional[Dict]:
     """
     Verify and extract watermark from protected image
+    Reads the binary payload, falling back to legacy JSON watermarks
     """
-    image = cv2.imread(image_path)
     if image is None:
         return None
     
+    metadata = extract_payload_lsb(image)
+    if metadata is not None:
+        return metadata
+    
     watermark_data = extract_watermark_lsb(image)
     
     if watermark_data:
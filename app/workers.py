@@ -0,0 +1,95 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+class PoolBusyError(RuntimeError):
+    """Raised when the worker pool queue is full and a job is refused"""
+
+class ProtectionPool:
+    """
+    Bounded executor for CPU-bound protection work
+    Keeps face detection, FFTs and PNG encoding off the asyncio event loop.
+    At most `workers + queue_depth` jobs are admitted at once; anything beyond
+    that is refused immediately so latency can't grow without limit.
+    """
+    
+    def __init__(self, mode: str = "thread", workers: Optional[int] = None, queue_depth: int = 8):
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.capacity = self.workers + max(queue_depth, 0)
+        self._executor = self._create_executor()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+    
+    def _create_executor(self) -> Executor:
+        if self.mode == "process":
+            return ProcessPoolExecutor(max_workers=self.workers)
+        if self.mode == "thread":
+            return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="protect")
+        raise ValueError(f"Unknown worker mode: {self.mode}")
+    
+    def _release(self, _future: Future):
+        with self._lock:
+            self._in_flight -= 1
+    
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        """
+        Run fn(*args) on the pool and await its result
+        Raises PoolBusyError if the pool is already at capacity
+        """
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                raise PoolBusyError("Worker pool is at capacity")
+            self._in_flight += 1
+        
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        
+        # Released when the job actually finishes, even if the request is cancelled
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+    
+    async def run_on_each_worker(self, fn: Callable, *args: Any, timeout: float = 60.0) -> int:
+        """
+        Run fn(*args) once on every worker, e.g. to warm per-thread state
+        before serving; returns the number of runs
+        In thread mode a barrier holds each run until all workers have picked
+        one up, so no thread runs two. Process pools are best effort.
+        """
+        if self.mode == "thread":
+            barrier = threading.Barrier(self.workers)
+            
+            def task():
+                try:
+                    barrier.wait(timeout)
+                except threading.BrokenBarrierError:
+                    pass
+                return fn(*args)
+        else:
+            task = partial(fn, *args)
+        
+        futures = [asyncio.wrap_future(self._executor.submit(task)) for _ in range(self.workers)]
+        await asyncio.gather(*futures)
+        return len(futures)
+    
+    def stats(self) -> Dict:
+        """Current pool configuration and load"""
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": in_flight
+        }
+    
+    def shutdown(self):
+        """Stop accepting work and drop anything still queued"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
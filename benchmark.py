@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Stage-level benchmark suite for the Consentra protection pipeline
+Times each pipeline stage on synthetic images across a resolution/level
+matrix, records wall time, peak RSS and throughput, and compares runs
+against a saved JSON baseline
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --threshold 0.2
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+DEFAULT_RESOLUTIONS_MP = [0.3, 2, 12, 24, 50]
+QUICK_RESOLUTIONS_MP = [0.3, 2]
+LEVELS = ["LOW", "MEDIUM", "HIGH"]
+
+# Stages whose cost depends on the protection level; the rest run once per resolution
+LEVEL_STAGES = ["adversarial_noise", "gradient_protection", "robustness", "protect_image"]
+SHARED_STAGES = ["analyze_image", "watermark_embed", "watermark_extract", "png_encode"]
+STAGES = SHARED_STAGES[:1] + LEVEL_STAGES + SHARED_STAGES[1:]
+
+# Changes below these are measurement noise and never a regression
+TIME_SLACK_MS = 1.0
+RSS_SLACK_MB = 16
+
+def synthetic_image(megapixels: float, seed: int = 0) -> np.ndarray:
+    """
+    Deterministic 4:3 BGR test image: smooth colour regions plus fine grain,
+    so encoders and detectors see photo-like content rather than flat colour
+    """
+    width = int(round((megapixels * 1_000_000 * 4 / 3) ** 0.5))
+    height = int(round(width * 3 / 4))
+    rng = np.random.default_rng(seed)
+    
+    coarse = rng.integers(0, 256, (height // 64 + 2, width // 64 + 2, 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    grain = rng.integers(0, 16, image.shape, dtype=np.uint8)
+    return cv2.add(image, grain)
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def _stage_runner(stage: str, image: np.ndarray, level: str):
+    """
+    Return (prepare, run) for a stage: prepare builds a fresh input outside
+    the timed region, run does the timed work on it
+    """
+    from app.agent import analyze_image
+    from app.image_protect import (
+        PROTECTION_PARAMS, apply_adversarial_noise, apply_gradient_based_protection,
+        create_rng, enhance_robustness, protect_image
+    )
+    from app.watermark import encode_image, verify_watermark, watermark_image
+    
+    params = PROTECTION_PARAMS[level]
+    
+    if stage == "analyze_image":
+        return (lambda: image), analyze_image
+    if stage == "adversarial_noise":
+        work = image.astype(np.float32)
+        return (lambda: create_rng(0)), lambda rng: apply_adversarial_noise(work, params["noise_strength"], rng)
+    if stage == "gradient_protection":
+        work = image.astype(np.float32)
+        return (lambda: create_rng(0)), lambda rng: apply_gradient_based_protection(
+            work, params["gradient_iterations"], rng
+        )
+    if stage == "robustness":
+        work = image.astype(np.float32)
+        return (lambda: work), enhance_robustness
+    if stage == "protect_image":
+        return (lambda: image), lambda img: protect_image(img, level, seed=0)
+    if stage == "watermark_embed":
+        return (lambda: image.copy()), lambda img: watermark_image(img, "benchmark-user", copy=False)
+    if stage == "watermark_extract":
+        marked = watermark_image(image, "benchmark-user")
+        return (lambda: marked), verify_watermark
+    if stage == "png_encode":
+        marked = watermark_image(image, "benchmark-user")
+        return (lambda: marked), encode_image
+    raise ValueError(f"Unknown stage: {stage}")
+
+def run_case(case: dict) -> dict:
+    """
+    Benchmark one (stage, resolution, level) case
+    Runs in a fresh process so peak RSS belongs to this case alone
+    """
+    image = synthetic_image(case["megapixels"])
+    height, width = image.shape[:2]
+    prepare, run = _stage_runner(case["stage"], image, case["level"] or "MEDIUM")
+    
+    # Peak RSS growth from here covers the stage's working set; the warm-up
+    # run also fills per-shape caches (masks, textures) like a live server
+    rss_before = _max_rss_mb()
+    run(prepare())
+    
+    times = []
+    for _ in range(case["repeat"]):
+        arg = prepare()
+        start = time.perf_counter()
+        run(arg)
+        times.append((time.perf_counter() - start) * 1000)
+        del arg
+    
+    peak_rss = _max_rss_mb()
+    median_ms = statistics.median(times)
+    megapixels = width * height / 1_000_000
+    return {
+        **case,
+        "width": width,
+        "height": height,
+        "wall_ms_median": round(median_ms, 2),
+        "wall_ms_min": round(min(times), 2),
+        "peak_rss_mb": round(peak_rss, 1),
+        "rss_growth_mb": round(peak_rss - rss_before, 1),
+        "mpix_per_s": round(megapixels / (median_ms / 1000), 2) if median_ms else None
+    }
+
+def build_cases(resolutions, levels, stages, repeat):
+    cases = []
+    for megapixels in resolutions:
+        for stage in stages:
+            for level in (levels if stage in LEVEL_STAGES else [None]):
+                cases.append({"stage": stage, "megapixels": megapixels, "level": level, "repeat": repeat})
+    return cases
+
+def case_key(result: dict) -> tuple:
+    return result["stage"], result["megapixels"], result["level"]
+
+def case_label(case: dict) -> str:
+    return f"{case['stage']} @ {case['megapixels']}MP" + (f" {case['level']}" if case["level"] else "")
+
+def run_benchmarks(cases):
+    """
+    Run every case in its own spawned worker process
+    Returns (results, failures); a case fails when it raises or its worker
+    process dies (killed by the OOM killer, segfault, ...)
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    failures = []
+    for i, case in enumerate(cases, 1):
+        print(f"[{i}/{len(cases)}] {case_label(case)} ...", end=" ", flush=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                result = pool.submit(run_case, case).result()
+            except MemoryError:
+                reason = "out of memory"
+            except BrokenProcessPool:
+                reason = "worker process crashed (killed or segfault)"
+            except Exception as e:
+                reason = f"{type(e).__name__}: {e}"
+            else:
+                reason = None
+        if reason is not None:
+            print(f"FAILED: {reason}")
+            failures.append(f"{case_label(case)}: {reason}")
+            continue
+        print(f"{result['wall_ms_median']:.1f}ms, {result['mpix_per_s']} MP/s, peak {result['peak_rss_mb']}MB")
+        results.append(result)
+    return results, failures
+
+def environment_info() -> dict:
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+def compare(results, baseline, time_threshold: float, memory_threshold: float, cases=None):
+    """
+    Compare results to a baseline run
+    Wall time is compared on the fastest run of each case, which is the least
+    sensitive to interference from other processes. Baseline cases that were
+    run this time (all of `cases`) but produced no result are regressions too
+    Returns a list of human-readable regression descriptions
+    """
+    previous = {case_key(entry): entry for entry in baseline["results"]}
+    current = {case_key(result) for result in results}
+    requested = {case_key(case) for case in cases} if cases is not None else set(previous)
+    regressions = [
+        f"{key}: in the baseline but produced no result"
+        for key in previous if key in requested and key not in current
+    ]
+    
+    print("\n" + "=" * 78)
+    print(f"{'stage':<22}{'MP':>6}{'level':>8}{'base min':>11}{'now min':>11}{'change':>10}")
+    print("=" * 78)
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        base_ms, now_ms = old["wall_ms_min"], result["wall_ms_min"]
+        change = now_ms / base_ms - 1 if base_ms else 0.0
+        flag = ""
+        if change > time_threshold and now_ms - base_ms > TIME_SLACK_MS:
+            flag = "  SLOWER"
+            regressions.append(f"{case_key(result)}: wall time {base_ms}ms -> {now_ms}ms")
+        memory_limit = old["rss_growth_mb"] * (1 + memory_threshold) + RSS_SLACK_MB
+        if result["rss_growth_mb"] > memory_limit:
+            flag += "  MORE MEMORY"
+            regressions.append(f"{case_key(result)}: RSS growth {old['rss_growth_mb']}MB -> {result['rss_growth_mb']}MB")
+        print(
+            f"{result['stage']:<22}{result['megapixels']:>6}{result['level'] or '-':>8}"
+            f"{base_ms:>11.1f}{now_ms:>11.1f}{change:>+10.1%}{flag}"
+        )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Consentra pipeline stages")
+    parser.add_argument("--resolutions", type=float, nargs="+", help="Megapixels to test (default 0.3 2 12 24 50)")
+    parser.add_argument("--levels", nargs="+", choices=LEVELS, default=LEVELS)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case (median is reported)")
+    parser.add_argument("--quick", action="store_true", help="Only the small resolutions (0.3 and 2MP)")
+    parser.add_argument("--output", help="Write results to this JSON file (e.g. a new baseline)")
+    parser.add_argument("--baseline", help="Compare against this JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed wall time increase (0.2 = 20%%)")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="Allowed RSS growth increase")
+    args = parser.parse_args()
+    
+    resolutions = args.resolutions or (QUICK_RESOLUTIONS_MP if args.quick else DEFAULT_RESOLUTIONS_MP)
+    repeat = args.repeat
+    
+    print("=" * 60)
+    print("CONSENTRA STAGE BENCHMARKS")
+    print("=" * 60)
+    
+    cases = build_cases(resolutions, args.levels, args.stages, repeat)
+    results, failures = run_benchmarks(cases)
+    report = {"environment": environment_info(), "results": results, "failures": failures}
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.memory_threshold, cases)
+        if regressions:
+            print(f"\n✗ {len(regressions)} regression(s):")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print("\n✓ No regressions")
+    
+    if failures:
+        print(f"\n✗ {len(failures)} case(s) failed:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,10 @@ Example Python client for Consentra API
 Shows how to integrate with the backend
 """
 
+import io
+import json
+import time
+import zipfile
 import requests
 from pathlib import Path
 
@@ -49,6 +53,77 @@ class ConsentraClient:
                 'error': response.text
             }
     
+    def protect_images_batch(self, image_paths, user_id=None):
+        """
+        Protect many images in one request
+        
+        Args:
+            image_paths: Paths to the image files
+            user_id: Optional user identifier for watermarking
+        
+        Returns:
+            dict with 'success', 'data' (zip bytes with protected PNGs),
+            'manifest' (per-image status, level and timing)
+        """
+        handles = [open(path, 'rb') for path in image_paths]
+        try:
+            files = [('files', (Path(path).name, f)) for path, f in zip(image_paths, handles)]
+            params = {'user_id': user_id} if user_id else {}
+            response = requests.post(
+                f"{self.base_url}/protect-images/batch",
+                files=files,
+                params=params
+            )
+        finally:
+            for f in handles:
+                f.close()
+        
+        if response.status_code == 200:
+            with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+                manifest = json.loads(archive.read('manifest.json'))
+            return {
+                'success': True,
+                'data': response.content,
+                'manifest': manifest
+            }
+        else:
+            return {
+                'success': False,
+                'error': response.text
+            }
+    
+    def protect_image_async(self, image_path, user_id=None, poll_interval=1.0, timeout=300):
+        """
+        Queue an image as a background job and poll until it finishes
+        
+        Args:
+            image_path: Path to the image file
+            user_id: Optional user identifier for watermarking
+            poll_interval: Seconds between status checks
+            timeout: Give up after this many seconds
+        
+        Returns:
+            dict with 'success', 'data' (image bytes), 'metadata' (job status)
+        """
+        with open(image_path, 'rb') as f:
+            params = {'user_id': user_id} if user_id else {}
+            response = requests.post(f"{self.base_url}/jobs", files={'file': f}, params=params)
+        if response.status_code != 202:
+            return {'success': False, 'error': response.text}
+        
+        status_url = f"{self.base_url}{response.json()['status_url']}"
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = requests.get(status_url).json()
+            if job['status'] == 'done':
+                result = requests.get(f"{self.base_url}{job['result_url']}")
+                return {'success': True, 'data': result.content, 'metadata': job}
+            if job['status'] == 'failed':
+                return {'success': False, 'error': job.get('error')}
+            time.sleep(poll_interval)
+        
+        return {'success': False, 'error': 'Timed out waiting for job'}
+    
     def verify_watermark(self, image_path):
         """
         Verify if an image has a Consentra watermark
@@ -106,6 +181,19 @@ if __name__ == "__main__":
     #         f.write(result['data'])
     #     print(f"Protected! Level: {result['metadata']['protection_level']}")
     
+    # Example: Protect a folder of images in one request
+    # batch = client.protect_images_batch(sorted(Path("photos").glob("*.jpg")), user_id="user123")
+    # if batch['success']:
+    #     with open("protected_photos.zip", "wb") as f:
+    #         f.write(batch['data'])
+    #     for image in batch['manifest']['images']:
+    #         print(image['filename'], image['status'], image.get('protection_level'))
+    
+    # Example: Queue an image and poll for the result
+    # job = client.protect_image_async("large_photo.jpg", user_id="user123")
+    # if job['success']:
+    #     print(f"Job done! Level: {job['metadata']['protection_level']}")
+    
     # Example: Verify watermark
     # watermark = client.verify_watermark("protected_photo.png")
     # print(f"Watermarked: {watermark.get('watermarked')}")
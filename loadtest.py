@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Concurrent load generator for the Consentra API
+Drives /protect-image and /verify-watermark either in-process (ASGI, no
+server needed) or against a running uvicorn, and reports throughput, error
+rates and latency percentiles
+
+    python loadtest.py --in-process --concurrency 4 --requests 50
+    python loadtest.py --url http://localhost:8000 --rate 2 --duration 60
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+
+import cv2
+import httpx
+
+from benchmark import synthetic_image
+
+# Default image mix: megapixels -> share of requests
+DEFAULT_SIZE_MIX = "0.3:0.5,2:0.4,8:0.1"
+
+def parse_size_mix(spec: str) -> list:
+    """Parse "MP:weight,MP:weight" into [(megapixels, weight)]"""
+    mix = []
+    for part in spec.split(","):
+        megapixels, _, weight = part.partition(":")
+        mix.append((float(megapixels), float(weight or 1)))
+    return mix
+
+def build_uploads(size_mix: list) -> dict:
+    """
+    Encode one synthetic JPEG per size in the mix
+    JPEG keeps large sizes under the upload limit, like real camera photos
+    """
+    uploads = {}
+    for i, (megapixels, _) in enumerate(size_mix):
+        success, encoded = cv2.imencode(".jpg", synthetic_image(megapixels, seed=i), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        if not success:
+            raise RuntimeError(f"Could not encode {megapixels}MP test image")
+        uploads[megapixels] = encoded.tobytes()
+    return uploads
+
+def percentile(sorted_values: list, q: float):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(q / 100 * len(sorted_values) + 0.5)))
+    return round(sorted_values[min(rank, len(sorted_values)) - 1], 2)
+
+class LoadTest:
+    """
+    Sends requests and records (endpoint, size, status, latency) samples
+    Closed loop: `concurrency` workers each send back-to-back requests
+    Open loop (rate set): Poisson arrivals at `rate` per second, regardless of
+    how fast responses come back, capped at `max_in_flight` outstanding
+    """
+    
+    def __init__(self, client: httpx.AsyncClient, uploads: dict, size_mix: list, verify_ratio: float,
+                 user_id: str = None, seed: int = 0):
+        self.client = client
+        self.uploads = uploads
+        self.sizes = [megapixels for megapixels, _ in size_mix]
+        self.weights = [weight for _, weight in size_mix]
+        self.verify_ratio = verify_ratio
+        self.user_id = user_id
+        self.verify_uploads = dict(uploads)
+        self.random = random.Random(seed)
+        self.samples = []
+        self.dropped = 0
+    
+    async def warm_up(self):
+        """Protect each size once; the outputs become the verify-watermark uploads"""
+        for megapixels, data in self.uploads.items():
+            response = await self.client.post(
+                "/protect-image", files={"file": (f"warmup_{megapixels}mp.jpg", data, "image/jpeg")}
+            )
+            if response.status_code == 200:
+                self.verify_uploads[megapixels] = response.content
+            else:
+                print(f"  warm-up {megapixels}MP: HTTP {response.status_code} {response.text[:100]}")
+    
+    async def send_one(self):
+        megapixels = self.random.choices(self.sizes, self.weights)[0]
+        if self.random.random() < self.verify_ratio:
+            endpoint, data = "/verify-watermark", self.verify_uploads[megapixels]
+            files = {"file": ("protected.png", data, "image/png")}
+            params = {}
+        else:
+            endpoint, data = "/protect-image", self.uploads[megapixels]
+            files = {"file": (f"load_{megapixels}mp.jpg", data, "image/jpeg")}
+            params = {"user_id": self.user_id} if self.user_id else {}
+        
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(endpoint, files=files, params=params)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.samples.append((endpoint, megapixels, status, (time.perf_counter() - start) * 1000))
+    
+    async def closed_loop(self, concurrency: int, total: int, deadline: float):
+        remaining = total
+        
+        async def worker():
+            nonlocal remaining
+            while remaining > 0 and time.perf_counter() < deadline:
+                remaining -= 1
+                await self.send_one()
+        
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    
+    async def open_loop(self, rate: float, total: int, deadline: float, max_in_flight: int):
+        in_flight = set()
+        sent = 0
+        next_arrival = time.perf_counter()
+        while sent < total and next_arrival < deadline:
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            if len(in_flight) >= max_in_flight:
+                self.dropped += 1
+            else:
+                task = asyncio.create_task(self.send_one())
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            sent += 1
+            next_arrival += self.random.expovariate(rate)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+def summarize(samples: list, elapsed: float, dropped: int) -> dict:
+    """Throughput, status counts and latency percentiles, overall and per endpoint"""
+    def stats(group):
+        ok = sorted(latency for _, _, status, latency in group if status == 200)
+        statuses = Counter(str(status) for _, _, status, _ in group)
+        return {
+            "requests": len(group),
+            "throughput_rps": round(len(group) / elapsed, 2) if elapsed else None,
+            "error_rate": round(1 - len(ok) / len(group), 4) if group else 0.0,
+            "statuses": dict(statuses),
+            "latency_ms": {
+                "p50": percentile(ok, 50),
+                "p95": percentile(ok, 95),
+                "p99": percentile(ok, 99),
+                "max": round(ok[-1], 2) if ok else None
+            }
+        }
+    
+    by_endpoint = defaultdict(list)
+    by_size = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample[0]].append(sample)
+        by_size[sample[1]].append(sample)
+    
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "dropped": dropped,
+        "overall": stats(samples),
+        "endpoints": {endpoint: stats(group) for endpoint, group in sorted(by_endpoint.items())},
+        "sizes_mp": {str(size): stats(group) for size, group in sorted(by_size.items())}
+    }
+
+def print_report(report: dict):
+    print("\n" + "=" * 78)
+    print("LOAD TEST RESULTS")
+    print("=" * 78)
+    print(f"Elapsed: {report['elapsed_s']}s   Dropped (open loop): {report['dropped']}")
+    print(f"{'':<22}{'reqs':>7}{'rps':>8}{'errors':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    
+    rows = [("overall", report["overall"])]
+    rows += list(report["endpoints"].items())
+    rows += [(f"{size}MP", stats) for size, stats in report["sizes_mp"].items()]
+    for name, stats in rows:
+        latency = stats["latency_ms"]
+        print(
+            f"{name:<22}{stats['requests']:>7}{stats['throughput_rps'] or 0:>8.2f}{stats['error_rate']:>9.1%}"
+            + "".join(f"{latency[key] if latency[key] is not None else '-':>9}" for key in ("p50", "p95", "p99", "max"))
+        )
+    print(f"\nStatus codes: {report['overall']['statuses']}")
+
+def make_client(args) -> httpx.AsyncClient:
+    timeout = httpx.Timeout(args.timeout)
+    if args.in_process:
+        from app.main import app, limiter
+        if args.no_rate_limit:
+            limiter.enabled = False
+        transport = httpx.ASGITransport(app=app)
+        return httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout)
+    
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.max_in_flight))
+    return httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits)
+
+async def run(args) -> dict:
+    size_mix = parse_size_mix(args.sizes)
+    print(f"Encoding test images: {', '.join(f'{mp}MP' for mp, _ in size_mix)}")
+    uploads = build_uploads(size_mix)
+    
+    async with make_client(args) as client:
+        test = LoadTest(client, uploads, size_mix, args.verify_ratio, args.user_id, args.seed)
+        if not args.no_warmup:
+            print("Warming up...")
+            await test.warm_up()
+        
+        mode = f"open loop at {args.rate} req/s" if args.rate else f"closed loop x{args.concurrency}"
+        print(f"Running {mode} ({args.requests} requests max, {args.duration}s max)")
+        start = time.perf_counter()
+        deadline = start + args.duration
+        if args.rate:
+            await test.open_loop(args.rate, args.requests, deadline, args.max_in_flight)
+        else:
+            await test.closed_loop(args.concurrency, args.requests, deadline)
+        elapsed = time.perf_counter() - start
+    
+    return summarize(test.samples, elapsed, test.dropped)
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for the Consentra API")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://localhost:8000", help="Server to test")
+    target.add_argument("--in-process", action="store_true", help="Drive the ASGI app directly, no server")
+    parser.add_argument("--concurrency", type=int, default=4, help="Closed-loop workers")
+    parser.add_argument("--rate", type=float, help="Open-loop arrival rate (requests/second)")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open-loop cap on outstanding requests")
+    parser.add_argument("--requests", type=int, default=100, help="Maximum requests to send")
+    parser.add_argument("--duration", type=float, default=60, help="Maximum test duration in seconds")
+    parser.add_argument("--sizes", default=DEFAULT_SIZE_MIX, help="Image size mix as MP:weight,... ")
+    parser.add_argument("--verify-ratio", type=float, default=0.2, help="Share of /verify-watermark requests")
+    parser.add_argument("--user-id", help="Send this user_id (makes repeat uploads result-cache hits)")
+    parser.add_argument("--no-rate-limit", action="store_true",
+                        help="Disable rate limits in-process (for a server, start it with RATE_LIMIT_ENABLED=false)")
+    parser.add_argument("--no-warmup", action="store_true", help="Skip the warm-up requests")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the request mix")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    args = parser.parse_args()
+    
+    if args.no_rate_limit and not args.in_process:
+        print("Note: rate limits are server-side; start the server with RATE_LIMIT_ENABLED=false")
+    
+    try:
+        report = asyncio.run(run(args))
+    except httpx.ConnectError:
+        print(f"\n✗ ERROR: Could not connect to {args.url}")
+        print("Start the server with: uvicorn app.main:app, or use --in-process")
+        sys.exit(1)
+    
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
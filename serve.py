@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the Consentra API
+Preloads the face cascade and pipeline modules, warms them up on
+representative image shapes, then forks N uvicorn workers that share the
+loaded state copy-on-write and accept from one listening socket
+
+    python serve.py --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("serve")
+
+# A worker that dies sooner than this after starting is failing on boot
+MIN_WORKER_UPTIME_SECONDS = 5.0
+
+def preload():
+    """
+    Import and warm the pipeline in the parent process
+    app.main is not imported here: it opens SQLite connections and worker
+    pools, which must be created fresh in each worker after the fork
+    """
+    import app.agent  # noqa: F401  (reads the Haar cascade XML into memory)
+    import app.pipeline  # noqa: F401
+    from app.warmup import warm_up
+    
+    state = warm_up()
+    if state["error"]:
+        logger.warning(f"Serving without a complete warm-up: {state['error']}")
+    
+    # Move everything loaded so far out of the collector's view, so the
+    # garbage collector doesn't touch (and copy) the shared pages in workers
+    gc.collect()
+    gc.freeze()
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(sock: socket.socket, args):
+    """Worker body: serve the app on the inherited socket until told to stop"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config("app.main:app", log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+
+def spawn_worker(sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        # Never return into the supervisor loop, even on SystemExit
+        status = 1
+        try:
+            run_worker(sock, args)
+            status = 0
+        except Exception:
+            logger.exception("Worker crashed")
+        finally:
+            os._exit(status)
+    logger.info(f"Started worker {pid}")
+    return pid
+
+def supervise(sock: socket.socket, args):
+    """
+    Fork the workers and keep the pool at size: crashed workers are replaced
+    SIGTERM/SIGINT are forwarded to every worker for a graceful shutdown
+    """
+    workers = {spawn_worker(sock, args): time.monotonic() for _ in range(args.workers)}
+    stopping = False
+    
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        
+        logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}")
+        if time.monotonic() - started < MIN_WORKER_UPTIME_SECONDS:
+            # Respawning a worker that can't boot would just spin
+            logger.error("Worker failed during startup, shutting down")
+            stop(signal.SIGTERM, None)
+            continue
+        workers[spawn_worker(sock, args)] = time.monotonic()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Consentra API with preloaded, forked workers")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1,
+        help="Worker processes (default WEB_CONCURRENCY, else one per CPU)"
+    )
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--keep-alive", type=int, default=5, help="Keep-alive timeout in seconds")
+    args = parser.parse_args()
+    
+    if not hasattr(os, "fork"):
+        # No fork (Windows): a single process still warms up before /ready passes
+        logger.warning("os.fork is unavailable, running a single worker")
+        uvicorn.run("app.main:app", host=args.host, port=args.port, log_level=args.log_level)
+        return
+    
+    start = time.perf_counter()
+    preload()
+    logger.info(f"Preloaded pipeline in {time.perf_counter() - start:.1f}s")
+    
+    sock = bind_socket(args.host, args.port)
+    logger.info(f"Listening on {args.host}:{args.port} with {args.workers} workers")
+    supervise(sock, args)
+    sock.close()
+    logger.info("All workers stopped")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@ Tests all endpoints and demonstrates functionality
 
 import requests
 import io
+import json
 from PIL import Image
 import numpy as np
 
@@ -103,6 +104,65 @@ def test_analytics():
         return True
     return False
 
+def test_concurrent_face_detection():
+    """Test face detection from several worker threads at once (runs in-process)"""
+    print("\n=== Testing Concurrent Face Detection ===")
+    import threading
+    import cv2
+    from app.agent import detect_faces
+    
+    gray = cv2.cvtColor(np.array(create_test_image()), cv2.COLOR_RGB2GRAY)
+    expected = detect_faces(gray)
+    results = []
+    
+    def detect():
+        for _ in range(20):
+            results.append(detect_faces(gray))
+    
+    threads = [threading.Thread(target=detect) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    print(f"Detections: {len(results)}, all matching: {set(results) == {expected}}")
+    return len(results) == 160 and set(results) == {expected}
+
+def test_legacy_watermark():
+    """Test that v1.0 JSON watermarks still embed bit-for-bit and decode (runs in-process)"""
+    print("\n=== Testing Legacy Watermark ===")
+    from app.watermark import create_watermark_metadata, embed_watermark_lsb, verify_watermark
+    
+    def legacy_embed(image, watermark_data):
+        # The original per-pixel encoder: length prefix, data, 16-bit terminator
+        bits = []
+        for char in f"{len(watermark_data)}|{watermark_data}":
+            bits.extend([int(b) for b in format(ord(char), '08b')])
+        bits.extend([0] * 16)
+        
+        watermarked = image.copy()
+        h, w, c = image.shape
+        bit_index = 0
+        for i in range(h):
+            for j in range(w):
+                for k in range(c):
+                    if bit_index < len(bits):
+                        watermarked[i, j, k] = (image[i, j, k] & 0xFE) | bits[bit_index]
+                        bit_index += 1
+        return watermarked
+    
+    image = np.random.default_rng(0).integers(0, 256, (64, 96, 3), dtype=np.uint8)
+    watermark_data = create_watermark_metadata("legacy-owner-123", consent=False)
+    legacy = legacy_embed(image, watermark_data)
+    
+    matches_legacy = np.array_equal(embed_watermark_lsb(image, watermark_data), legacy)
+    decoded = verify_watermark(legacy)
+    decodes = decoded == json.loads(watermark_data)
+    
+    print(f"Embed matches legacy encoder: {matches_legacy}")
+    print(f"Decoded: {decoded}")
+    return matches_legacy and decodes
+
 def test_rate_limiting():
     """Test rate limiting (should fail after 10 requests)"""
     print("\n=== Testing Rate Limiting ===")
@@ -141,6 +201,8 @@ def run_all_tests():
     results['Image Protection'] = test_protect_image()
     results['Watermark Verification'] = test_verify_watermark()
     results['Analytics'] = test_analytics()
+    results['Concurrent Face Detection'] = test_concurrent_face_detection()
+    results['Legacy Watermark'] = test_legacy_watermark()
     results['Rate Limiting'] = test_rate_limiting()
     
     print("\n" + "=" * 60)